@@ -18,10 +18,16 @@ class Node(object):
     # point, and it lets us enforce restrictions on certain Node subclasses by
     # overloading _addParent() (like Root, which shouldn't have a parent).
     self._parents = []
+    # Cached result of _compositeCache(), or None if it needs recomputing.
+    self._cache = None
+    # Cached result of _boundingSphere(), likewise.  It's only ever valid
+    # while _cache is, so _invalidate() can keep treating _cache as the flag.
+    self._bound = None
   
   def addChild(self, c):
     self._addChild(c)
     c._addParent(self)
+    self._invalidate()
   
   def printTree(self):
     self._printTree("")
@@ -77,6 +83,115 @@ class Node(object):
     # c.f. http://stackoverflow.com/q/952914
     return [T for tuples in tuple_lists for T in tuples]
   
+  def _compositeCache(self):
+    """Returns the composite transforms for all objects below this node.
+    
+    Returns a 3-tuple (xforms, shapes, surfs) describing each object
+    instance in the subtree rooted here, in the same order that _traverse()
+    would produce them:
+     - xforms (Nx4x4 numpy array): the composite transform from each
+       object's space into the space "above" this node (i.e. including
+       this node's own transform).  The array is read-only.
+     - shapes: a list of the N ShapeNode objects.
+     - surfs: a list of the N SurfaceNodes most recently encountered on the
+       way down to each object, or None where there was none below here.
+    
+    The result is cached, and only recomputed after _invalidate() is called
+    on this node or on one of its descendants.  Since each node caches its
+    own subtree, a subtree shared by several parents is only computed once,
+    and after a change deep in the graph, only the changed node and its
+    ancestors recompute anything; every other subtree's cache is reused.
+    """
+    if self._cache is None:
+      parts = [c._compositeCache() for c in self._children]
+      if len(parts) == 0:
+        xforms = np.empty((0, 4, 4))
+      else:
+        xforms = np.concatenate([p[0] for p in parts], 0)
+      xforms = np.matmul(self._xform, xforms)
+      xforms.flags.writeable = False
+      shapes = [s for p in parts for s in p[1]]
+      surfs = [s for p in parts for s in p[2]]
+      if self._getSurface() is not None:
+        surfs = [self._getSurface() if s is None else s for s in surfs]
+      self._cache = (xforms, shapes, surfs)
+    return self._cache
+  
+  def _invalidate(self):
+    """Marks this node's cached composite transforms as out of date.
+    
+    This also invalidates every ancestor's cache, since each of those
+    includes this node's subtree.  A node can only have a valid cache if
+    all its descendants do, so if this node is already invalid, so are all
+    its ancestors, and we can stop.
+    """
+    if self._cache is None:
+      return
+    self._cache = None
+    self._bound = None
+    for p in self._parents:
+      p._invalidate()
+  
+  def _boundingSphere(self):
+    """Returns a bounding sphere for all the objects below this node.
+    
+    Returns a 2-tuple (center, radius): a 3-element numpy array and a
+    number, describing a sphere that contains every object instance in the
+    subtree rooted here, in the space "above" this node (as for the
+    transforms from _compositeCache()).  Returns None if there are no
+    instances below here.
+    
+    The sphere is cached along with the composite transforms, and made
+    from the children's spheres, so like them it's only recomputed for the
+    nodes that have changed and their ancestors.
+    """
+    if self._bound is None:
+      # Make sure the composite cache is valid too; see __init__().
+      self._compositeCache()
+      spheres = [c._boundingSphere() for c in self._children]
+      spheres = [s for s in spheres if s is not None]
+      if len(spheres) == 0:
+        self._bound = ()
+      else:
+        centers = np.array([c for (c, _r) in spheres])
+        radii = np.array([r for (_c, r) in spheres])
+        self._bound = transformSphere(self._xform,
+                                      *enclosingSphere(centers, radii))
+    return self._bound if len(self._bound) > 0 else None
+  
+  def _visibleInstances(self, M, planes, offset):
+    """Finds the object instances below this node that might be visible.
+    
+    Arguments:
+     - M (4x4): the composite transform from the space above this node to
+       world space.
+     - planes (Px4): P planes (a,b,c,d) in world space, such that a point
+       (x,y,z) is on the visible side of all of them if ax+by+cz+d >= 0.
+     - offset: the index of this subtree's first instance in the whole
+       scene's list of instances.
+    
+    Returns a list of 1-D arrays of instance indices (in the order of
+    _compositeCache()), leaving out whole subtrees whose bounding spheres
+    are entirely on the invisible side of some plane.  Subtrees entirely
+    on the visible side of every plane aren't descended into at all.
+    """
+    sphere = self._boundingSphere()
+    if sphere is None:
+      return []
+    (center, radius) = transformSphere(M, *sphere)
+    dist = planes[:, :3].dot(center) + planes[:, 3]
+    if np.any(dist < -radius):
+      return []
+    count = len(self._compositeCache()[1])
+    if np.all(dist >= radius) or len(self._children) == 0:
+      return [np.arange(offset, offset + count)]
+    M = M.dot(self._xform)
+    visible = []
+    for c in self._children:
+      visible += c._visibleInstances(M, planes, offset)
+      offset += len(c._compositeCache()[1])
+    return visible
+  
   def __str__(self):
     if self.name is not None and len(self.name) > 0:
       return self.__class__.__name__ + " '" + self.name + "'"
@@ -85,3 +200,29 @@ class Node(object):
   
   def __repr__(self):
     return str(self)
+
+
+def enclosingSphere(centers, radii):
+  """Returns a sphere (center, radius) that contains some other spheres.
+  
+  Arguments:
+   - centers (Kx3): the centers of K spheres.
+   - radii (length K): their radii.
+  
+  The result is centered on the middle of the spheres' bounding box.
+  It's not the smallest enclosing sphere, but it's cheap and close.
+  """
+  lo = np.amin(centers - radii[:, None], 0)
+  hi = np.amax(centers + radii[:, None], 0)
+  center = (lo + hi) / 2.0
+  return (center, np.amax(np.sqrt(np.sum((centers - center)**2, 1)) + radii))
+
+def transformSphere(M, center, radius):
+  """Returns a sphere (center, radius) containing a transformed sphere.
+  
+  M is a 4x4 affine transform.  The new radius is scaled by the largest
+  stretch factor of M, so the result is exact for rigid motions and
+  uniform scales, and a bound for anything else.
+  """
+  return (M[:3, :3].dot(center) + M[:3, 3],
+          radius * np.linalg.norm(M[:3, :3], 2))
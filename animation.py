@@ -0,0 +1,240 @@
+"""
+animation --- Rendering sequences of frames, e.g. for animations.
+
+The main entry point is renderFrames(), which renders a whole sequence of
+(scene, camera) pairs with projection_renderer, optionally spreading the
+frames across a pool of worker processes.  Finished frames come out in
+order, to a callback, a directory, or a returned list.
+
+Frames of an animation usually share most of their mesh data: a joint-
+angle sweep of the robot arm changes a few transforms, not the cube.  So
+before rendering, each frame is boiled down to its instance transforms,
+colors, and references into a table of unique meshes.  The meshes are
+handed to each worker once, and every frame after that costs only a few
+small arrays to ship.  (Frames are described as they're rendered, so the
+workers start with the first frame's meshes; any mesh that first turns up
+in a later frame is shipped along with the frames that use it.)
+
+Example, sweeping the elbow of the arm in scene.py:
+
+  def pose(i):
+    elbow = np.array([-np.pi/2 + i*np.pi/60, 0, 0])
+    return (scene.makeScene(1, 5, 5, 2, shoulder, elbow, wrist, 10, 2.5,
+                            tree_bend, trunk_bend), camera)
+
+  animation.renderFrames(pose, 300, 200, num_frames=60, processes=4,
+                         out_dir='frames')
+"""
+import collections
+import hashlib
+import itertools
+import multiprocessing
+import os
+import numpy as np
+import scenegraph as sg
+import frame_io
+import projection_renderer
+from renderer import ScratchPool
+
+def renderFrames(frames, width, height, num_frames=None, callback=None,
+                 out_dir=None, out_format='npy', processes=None, **options):
+  """Renders a sequence of frames.
+
+  Arguments:
+   - frames: either a sequence of (scene, camera) pairs, or a function
+     that takes a frame number and returns a (scene, camera) pair.  Each
+     scene is a RootNode and each camera a Camera.
+   - width, height: the image size, in pixels, for every frame.
+   - num_frames (optional): the number of frames to render.  Required if
+     frames is a function, which is then called for 0, ..., num_frames-1.
+   - callback (optional): a function called as callback(i, img) for each
+     frame, in order, as soon as frame i and all earlier ones are done.
+   - out_dir (optional): a directory to save each frame to, in order, as
+     "frame_00000.npy" and so on.
+   - out_format (optional; default 'npy'): the file format for out_dir:
+     'npy' (numpy arrays, as rendered), 'ppm', 'pam', 'png', or 'raw'
+     (see the frame_io module).  For 'raw', all the frames go into one
+     memory-mapped frame sequence, "frames.raw".
+   - processes (optional): the number of worker processes.  If None,
+     every frame is rendered in this process.
+  Any other keyword arguments (engine, etc.) are passed on to
+  projection_renderer.renderInstances() for every frame.
+
+  If neither callback nor out_dir is given, returns a list of all the
+  rendered images; otherwise nothing is returned, and no more than a few
+  frames are ever held in memory at once.
+  """
+  if callable(frames):
+    if num_frames is None:
+      raise ValueError("num_frames is required when frames is a function.")
+    factory = frames
+    frames = (factory(i) for i in range(num_frames))
+  elif num_frames is not None:
+    frames = frames[:num_frames]
+
+  # Each frame's scene is only built and described when its job is needed,
+  # so frames stream out as they're rendered.  The first job is made before
+  # the workers start, so that they get its meshes up front.
+  table = _MeshTable()
+  jobs = _frameJobs(frames, table, width, height, options)
+  jobs = itertools.chain(list(itertools.islice(jobs, 1)), jobs)
+  meshes = table.meshes[:table.shared]
+
+  if processes is None:
+    _initWorker(meshes)
+    images = (_workerRenderFrame(job) for job in jobs)
+    return _emit(images, callback, out_dir, out_format)
+
+  pool = multiprocessing.Pool(processes, _initWorker, (meshes,))
+  try:
+    result = _emit(_poolImages(pool, jobs, 2*processes), callback, out_dir,
+                   out_format)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return result
+
+def _frameJobs(frames, table, width, height, options):
+  """Yields a job for _workerRenderFrame() for each (scene, camera) pair.
+
+  Each job carries the frame's description from the mesh table, and the
+  meshes it uses that the workers weren't started with.
+  """
+  for (scene, camera) in frames:
+    (xforms, mesh_ids, colors) = table.describe(scene)
+    if table.shared is None:
+      table.shared = len(table.meshes)
+    new = dict((i, table.meshes[i]) for i in set(mesh_ids.tolist())
+               if i >= table.shared)
+    yield ((xforms, mesh_ids, colors), new, camera, width, height, options)
+
+def _poolImages(pool, jobs, ahead):
+  """Yields the rendered images of jobs, in order, from a worker pool.
+
+  The jobs are made in this thread (so the frames function is only called
+  here), and only as needed to keep ahead of them in the pool.
+  """
+  pending = collections.deque()
+  for job in jobs:
+    pending.append(pool.apply_async(_workerRenderFrame, (job,)))
+    if len(pending) >= ahead:
+      yield pending.popleft().get()
+  while pending:
+    yield pending.popleft().get()
+
+def _emit(images, callback, out_dir, out_format):
+  """Sends rendered images, in order, wherever renderFrames() says to."""
+  if callback is None and out_dir is None:
+    return list(images)
+  if out_format != 'npy' and out_format not in frame_io.WRITERS:
+    raise ValueError("Unknown frame format '%s'." % out_format)
+  if out_dir is not None and not os.path.isdir(out_dir):
+    os.makedirs(out_dir)
+  sequence = None
+  try:
+    for (i, img) in enumerate(images):
+      if out_dir is None:
+        pass
+      elif out_format == 'npy':
+        np.save(os.path.join(out_dir, "frame_%05d.npy" % i), img)
+      elif out_format == 'raw':
+        if sequence is None:
+          sequence = frame_io.RawFrameSequence(
+            os.path.join(out_dir, "frames.raw"), 'w', *img.shape[:2])
+        sequence.append(img)
+      else:
+        frame_io.writeFrame(
+          os.path.join(out_dir, "frame_%05d.%s" % (i, out_format)), img)
+      if callback is not None:
+        callback(i, img)
+  finally:
+    if sequence is not None:
+      sequence.close()
+
+
+class _MeshTable(object):
+  """A table of the unique meshes used by a sequence of scenes.
+
+  Meshes are identified first by the identity of their arrays (cheap, and
+  enough for any scene that reuses its meshes), and failing that by their
+  contents, so that regenerating an identical mesh for every frame still
+  only puts one copy in the table.  The shared attribute is the number of
+  meshes, from the start of the table, that every worker was started with
+  (None until the first scene has been described).
+  """
+
+  def __init__(self):
+    self.meshes = []
+    self.shared = None
+    self._by_digest = {}
+    # Identity lookups only remember the previous frame's meshes, so that we
+    # don't keep every frame's garbage arrays alive.
+    self._by_id = {}
+
+  def describe(self, scene):
+    """Returns a compact description of a scene's instances.
+
+    The description is a tuple (xforms, mesh_ids, colors): an Ix4x4 array
+    of instance transforms, a length-I array of indices into self.meshes,
+    and an Ix3 array of surface colors.
+    """
+    instances = scene.getCompositeTransforms()
+    seen = {}
+    mesh_ids = []
+    for (_xform, node, _surf) in instances:
+      (verts, tris) = node.mesh
+      key = (id(verts), id(tris))
+      if key in seen:
+        mesh_ids.append(seen[key][2])
+        continue
+      if key in self._by_id:
+        index = self._by_id[key][2]
+      else:
+        index = self._add(verts, tris)
+      seen[key] = (verts, tris, index)
+      mesh_ids.append(index)
+    self._by_id = seen
+
+    xforms = np.array([xform for (xform, _n, _s) in instances]).reshape(-1,4,4)
+    colors = np.array([surf.color for (_x, _n, surf) in instances],
+                      dtype=float).reshape(-1, 3)
+    return (xforms, np.array(mesh_ids, dtype=int), colors)
+
+  def _add(self, verts, tris):
+    digest = hashlib.sha1()
+    for arr in (verts, tris):
+      arr = np.ascontiguousarray(arr)
+      digest.update(str((arr.shape, arr.dtype.str)).encode('ascii'))
+      digest.update(arr.tobytes())
+    digest = digest.hexdigest()
+    if digest not in self._by_digest:
+      self._by_digest[digest] = len(self.meshes)
+      self.meshes.append((verts, tris))
+    return self._by_digest[digest]
+
+
+# Per-process state for the pool workers, set up by _initWorker().  Each mesh
+# gets one ShapeNode, keyed by its index in the mesh table, which every
+# frame's instances then share, and the frames share one pool of scratch
+# arrays.
+_worker = {}
+
+def _initWorker(meshes):
+  _worker['shapes'] = dict((i, sg.ShapeNode(mesh, "mesh %d" % i))
+                           for (i, mesh) in enumerate(meshes))
+  _worker['scratch'] = ScratchPool()
+
+def _workerRenderFrame(job):
+  ((xforms, mesh_ids, colors), new, camera, width, height, options) = job
+  shapes = _worker['shapes']
+  for (i, mesh) in new.items():
+    if i not in shapes:
+      shapes[i] = sg.ShapeNode(mesh, "mesh %d" % i)
+  instances = [(xforms[i], shapes[mesh_ids[i]], sg.SurfaceNode(colors[i]))
+               for i in range(len(mesh_ids))]
+  return projection_renderer.renderInstances(instances, camera, width, height,
+                                             scratch=_worker['scratch'],
+                                             **options)
@@ -0,0 +1,285 @@
+"""
+benchmark --- Headless performance benchmarks for the renderer.
+
+Runs the raster renderer (with each requested engine), the depth-only
+pass, the wireframe geometry path, and the wireframe image renderer on a
+few canonical scenes, sweeping image resolution and triangle count, and
+reports the results as JSON:
+
+ - "arm": the arm-and-trees scene from scene.makeScene(), at the camera
+   pose used in scene.main(), at several resolutions.
+ - "sphere": a single meshes.sphere(K), for a sweep of K.
+ - "trefoil": a single our_shapes.trefoilKnot(K), for a sweep of K.
+
+Before the cases, we time a cold import of the renderer's modules in a
+fresh interpreter, and check that no plotting backend (Matplotlib, Mayavi)
+was loaded along the way: the renderer must stay importable, and quick to
+start, on a server with nothing but NumPy.  If a backend was loaded, the
+report is still written, but the exit status is 1.
+
+For each case, we report the wall time of each stage (best of several
+repeats), the breakdown of the raster render into pipeline stages and its
+counters (from render_stats), triangles/sec and pixels/sec for the raster
+render, and the peak resident memory of the process that ran it.  Every case runs in its own
+fresh worker process, so that the memory numbers don't leak from one case
+into the next.
+
+Run it from the command line:
+
+  python benchmark.py                      # full sweep, JSON to stdout
+  python benchmark.py --quick -o out.json  # a small sweep, JSON to a file
+  python benchmark.py --engines batch --scenes sphere,trefoil
+
+Nothing here needs a display or any plotting library.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+from timeit import default_timer as timer
+import numpy as np
+
+# Resolutions and mesh parameters for the full and --quick sweeps.
+FULL_SWEEP = {
+  'arm': [(150, 100), (300, 200), (600, 400), (1200, 800)],
+  'sphere': [4, 8, 16, 32, 64],
+  'trefoil': [2, 4, 8, 16],
+}
+QUICK_SWEEP = {
+  'arm': [(150, 100), (300, 200)],
+  'sphere': [4, 16],
+  'trefoil': [2, 4],
+}
+# Image size for the triangle-count sweeps.
+SWEEP_SIZE = (300, 300)
+
+# The modules whose cold import is timed, and the plotting backends that
+# importing them must not drag in.
+CORE_MODULES = ['projection_renderer', 'camera', 'scenegraph', 'meshes',
+                'our_shapes', 'flat_scene', 'tile_renderer', 'animation',
+                'render_stats', 'scene', 'robot_scene']
+BACKEND_MODULES = ['matplotlib', 'mayavi', 'mpl_toolkits',
+                   'gfx_helper_script', 'gfx_helper_mayavi']
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(
+    description="Benchmark the projection renderer.")
+  parser.add_argument('--engines', default='vector,batch',
+    help="comma-separated raster engines to run (default: vector,batch)")
+  parser.add_argument('--scenes', default='arm,sphere,trefoil',
+    help="comma-separated scenes to run (default: arm,sphere,trefoil)")
+  parser.add_argument('--repeat', type=int, default=3,
+    help="timing repeats per case; the best is reported (default: 3)")
+  parser.add_argument('--quick', action='store_true',
+    help="run a small sweep, for a fast smoke test")
+  parser.add_argument('-o', '--output',
+    help="write the JSON report here instead of to stdout")
+  args = parser.parse_args(argv)
+
+  sweep = QUICK_SWEEP if args.quick else FULL_SWEEP
+  cases = makeCases(args.scenes.split(','), args.engines.split(','), sweep)
+  report = {
+    'host': {
+      'python': platform.python_version(),
+      'numpy': np.__version__,
+      'machine': platform.machine(),
+      'cpus': multiprocessing.cpu_count(),
+    },
+    'repeat': args.repeat,
+    'startup': measureStartup(),
+    'results': runCases(cases, args.repeat),
+  }
+
+  text = json.dumps(report, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, 'w') as f:
+      f.write(text + '\n')
+  else:
+    sys.stdout.write(text + '\n')
+
+  if report['startup']['backends_loaded']:
+    sys.stderr.write("Importing the renderer loaded plotting backends: %s\n"
+                     % ", ".join(report['startup']['backends_loaded']))
+    sys.exit(1)
+
+def measureStartup():
+  """Times a cold import of CORE_MODULES in a fresh interpreter.
+
+  Returns a dict with:
+   - 'import_sec': the wall time of the imports, in seconds.
+   - 'modules_loaded': the number of modules loaded by them.
+   - 'backends_loaded': the names in BACKEND_MODULES that got loaded
+     (this should be empty).
+  """
+  script = "\n".join([
+    "import json, sys",
+    "from timeit import default_timer as timer",
+    "before = set(sys.modules)",
+    "start = timer()",
+    "import %s" % ", ".join(CORE_MODULES),
+    "elapsed = timer() - start",
+    "print(json.dumps({",
+    "  'import_sec': elapsed,",
+    "  'modules_loaded': len(set(sys.modules) - before),",
+    "  'backends_loaded': [m for m in %r" % BACKEND_MODULES,
+    "                      if m in sys.modules]}))",
+  ])
+  here = os.path.dirname(os.path.abspath(__file__))
+  output = subprocess.check_output([sys.executable, '-c', script], cwd=here)
+  return json.loads(output.decode('ascii'))
+
+def makeCases(scenes, engines, sweep):
+  """Returns the list of benchmark cases for some scenes and engines.
+
+  Each case is a dict with the keys 'scene', 'param' (the K for the mesh
+  scenes, or None), 'width', 'height', and 'engine'.
+  """
+  cases = []
+  for name in scenes:
+    if name not in sweep:
+      raise ValueError("Unknown benchmark scene '%s'." % name)
+    for p in sweep[name]:
+      if name == 'arm':
+        (param, (width, height)) = (None, p)
+      else:
+        (param, (width, height)) = (p, SWEEP_SIZE)
+      for engine in engines:
+        cases.append({'scene': name, 'param': param,
+                      'width': width, 'height': height, 'engine': engine})
+  return cases
+
+def runCases(cases, repeat):
+  """Runs each case in a fresh worker process and returns the results."""
+  results = []
+  for case in cases:
+    pool = multiprocessing.Pool(1)
+    try:
+      results.append(pool.apply(runCase, (case, repeat)))
+      pool.close()
+    except:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+  return results
+
+def runCase(case, repeat):
+  """Runs one benchmark case in this process, and returns its results.
+
+  The result is the case dict, plus:
+   - 'triangles': the total number of triangles in the scene.
+   - 'stages': the best wall time, in seconds, of each stage.
+   - 'raster_stages': the pipeline stage times, in seconds, of one more
+     raster render, and 'counters': its render_stats counters.
+   - 'triangles_per_sec', 'pixels_per_sec': throughput of the raster
+     render (the 'raster' stage, end to end).
+   - 'peak_rss_kb': the peak resident memory of the process, and
+     'base_rss_kb', its peak before the scene was built.
+  """
+  import flat_scene
+  import projection_renderer
+  import render_stats
+
+  base_rss = _peakRSS()
+  (scene, camera) = makeScene(case['scene'], case['param'],
+                              case['width'], case['height'])
+  (width, height) = (case['width'], case['height'])
+
+  stages = {}
+  def best(name, fn):
+    for _ in range(repeat):
+      start = timer()
+      result = fn()
+      elapsed = timer() - start
+      stages[name] = min(stages.get(name, elapsed), elapsed)
+    return result
+
+  flat = best('flatten', lambda: flat_scene.flattenScene(scene))
+  best('raster', lambda: projection_renderer.renderRaster(
+    scene, camera, width, height, engine=case['engine']))
+
+  # One more raster render, collecting stats, for the per-stage breakdown.
+  # (It's kept out of the timings above, since counting costs a little.)
+  stats = render_stats.RenderStats()
+  projection_renderer.renderRaster(scene, camera, width, height,
+                                   engine=case['engine'], stats=stats)
+  best('depth', lambda: projection_renderer.renderDepth(
+    scene, camera, width, height))
+  best('wireframe', lambda: projection_renderer.wireframeLines(
+    scene, camera, width, height))
+  best('wireframe_image', lambda: projection_renderer.renderWireframe(
+    scene, camera, width, height))
+
+  result = dict(case)
+  result['triangles'] = int(flat.numTriangles())
+  result['stages'] = stages
+  result['raster_stages'] = stats.times
+  result['counters'] = stats.counters
+  result['triangles_per_sec'] = flat.numTriangles() / stages['raster']
+  result['pixels_per_sec'] = width * height / stages['raster']
+  result['base_rss_kb'] = base_rss
+  result['peak_rss_kb'] = _peakRSS()
+  return result
+
+def makeScene(name, param, width, height):
+  """Builds one of the benchmark scenes, and a camera to view it.
+
+  Returns (scene, camera): a RootNode and a Camera whose view angles are
+  set for a (width)x(height) image.
+  """
+  import meshes
+  import our_shapes
+  import scene
+  import scenegraph as sg
+  from camera import Camera
+
+  if name == 'arm':
+    root = scene.makeScene(1, 5, 5, 2,
+                           np.array([np.pi/4, 0, 0]),
+                           np.array([-np.pi/2, 0, 0]),
+                           np.array([0, np.pi/2, np.pi/4]),
+                           10, 2.5,
+                           np.array([0, np.pi/10, 0]),
+                           np.array([0, -np.pi/5, 0]))
+    camera = Camera([13.2, -41.2, 19.0], [0, 0, 2.5], [0, 0, 1], 0.01, 300)
+    camera.setViewAngles(float(width)/height, 35)
+    return (root, camera)
+
+  if name == 'sphere':
+    mesh = meshes.sphere(param)
+  elif name == 'trefoil':
+    (verts, tris) = our_shapes.trefoilKnot(param)
+    mesh = (our_shapes.vertsToHomogeneous(verts), tris)
+  else:
+    raise ValueError("Unknown benchmark scene '%s'." % name)
+
+  # Frame the mesh: look at the center of its bounding box from a distance
+  # of a few times its radius.
+  lo = np.amin(mesh[0][:3], axis=1)
+  hi = np.amax(mesh[0][:3], axis=1)
+  center = (lo + hi) / 2.0
+  radius = np.linalg.norm(hi - lo) / 2.0
+  eye = center + radius * np.array([1.5, -2.0, 1.2])
+
+  root = sg.RootNode()
+  surf = sg.SurfaceNode(np.array([91, 199, 252])/256.0, "surf")
+  root.addChild(surf)
+  surf.addChild(sg.ShapeNode(mesh, name))
+  camera = Camera(eye, center, [0, 0, 1], 0.1*radius, 10*radius)
+  camera.setViewAngles(float(width)/height, 40)
+  return (root, camera)
+
+def _peakRSS():
+  """Returns this process's peak resident set size, in kilobytes."""
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Linux reports kilobytes, but macOS reports bytes.
+  if sys.platform == 'darwin':
+    rss //= 1024
+  return rss
+
+if __name__ == "__main__":
+  main()
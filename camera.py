@@ -129,6 +129,24 @@ class Camera(object):
     """
     return self.perspectiveNormalizationXform().dot(self.worldToCameraCentricXform())
 
+  def frustumPlanes(self):
+    """Returns the six planes bounding this camera's view frustum.
+
+    Returns a 6x4 numpy array, one plane (a,b,c,d) per row, in world
+    coordinates: left, right, bottom, top, near, and far.  A world-space
+    point (x,y,z) is inside the frustum if a*x + b*y + c*z + d >= 0 for
+    every plane, and since each (a,b,c) is a unit vector, that sum is the
+    point's distance from the plane.
+
+    The planes are read straight off the rows of the world-to-canonical-
+    view transform: the frustum is where -w <= x,y,z <= w after it.
+    """
+    M = self.worldToCanonicalViewXform()
+    planes = np.array([M[3] + M[0], M[3] - M[0],
+                       M[3] + M[1], M[3] - M[1],
+                       M[3] - M[2], M[3] + M[2]])
+    return planes / norm(planes[:, :3], axis=1)[:, None]
+
   def translateToOriginXform(self):
     """Returns the transform that translates this camera to the origin.
 
@@ -0,0 +1,212 @@
+"""
+clipping --- Homogeneous triangle and line clipping, before dividing by w.
+
+Dividing by w is only safe for points in front of the camera.  A triangle
+that crosses the camera plane (w <= 0) comes out of the division turned
+inside out, smeared across the whole screen; one with a vertex very close
+to it gets a vast bounding box.  So the triangles are clipped first, in
+homogeneous clip space (that is, after the perspective normalization
+transform but before dividing by w), where the view volume is the box
+-w <= x,y,z <= w and everything is still linear:
+
+ - A triangle entirely outside any side of the view volume is dropped.
+ - A triangle that crosses the near or far plane is clipped to it.  The near
+   plane is at z = w, and since w >= near > 0 on the inside of it, this
+   also cuts off everything at or behind the camera plane.
+ - A triangle that reaches past the guard band, a box GUARD_BAND times
+   the size of the screen, is clipped to that.  Triangles that only stick
+   out of the screen a little are left alone, since the rasterizers clamp
+   their bounding boxes to the screen anyway; the guard band just keeps the
+   divided coordinates to a sane size.
+
+Clipping a triangle against several planes leaves a convex polygon, which
+is cut back into a fan of triangles in the same winding order.  The pieces
+lie in the plane of the original triangle, so the image is the same as
+the unclipped triangle's wherever that was drawn correctly.
+
+clipSegments() does the same for the line segments of a wireframe, against
+the near plane only.
+"""
+import numpy as np
+import render_stats
+
+# The x/y extent of the guard band, as a multiple of the screen's.
+GUARD_BAND = 16.0
+
+def clipTriangles(verts, tris, colors, guard_band=GUARD_BAND,
+                  stats=render_stats.NO_STATS, scratch=None):
+  """Clips triangles to the view volume, in homogeneous clip space.
+
+  Arguments:
+   - verts (4xN): the clip-space coordinates of N vertices (after the
+     perspective normalization transform, before dividing by w).
+   - tris (Tx3): the indices into verts of the corners of T triangles.
+   - colors (Tx3): the color of each triangle.
+   - guard_band (optional): the x/y extent of the guard band, as a
+     multiple of the screen's.
+   - stats (optional): a RenderStats object to count triangles into.
+   - scratch (optional): a renderer.ScratchPool to take the per-triangle
+     plane distances, and the triangles and colors returned when nothing
+     needs clipping, from.  (The pieces of clipped triangles are always new
+     arrays.)
+
+  Returns (verts, tris, colors, source):
+   - verts (4xN'): the vertex buffer, with the corners of any clipped
+     pieces appended to the original N vertices.
+   - tris (T'x3), colors (T'x3): the triangles after clipping.  Each
+     original triangle is replaced, in place, by zero or more pieces, so
+     the triangles stay in their original order.
+   - source (length T'): the index of the original triangle that each
+     triangle came from.
+  Every vertex used by the returned triangles has w > 0.
+  """
+  num_tris = tris.shape[0]
+  # Signed distances (well, w-scaled ones) of every vertex to the planes,
+  # positive inside.  The first four are the screen's sides, for rejecting;
+  # the last six are the near, far, and guard band planes, for clipping.
+  planes = _clipPlanes(guard_band)
+  if scratch is None:
+    dist = planes.dot(verts)[:, tris]  # (planes)xTx3
+    inside = dist >= 0
+  else:
+    dist = np.take(
+      np.dot(planes, verts,
+             out=scratch.get('plane_dist', (len(planes), verts.shape[1]))),
+      tris, 1, out=scratch.get('clip_dist', (len(planes),) + tris.shape))
+    inside = np.greater_equal(dist, 0,
+                              out=scratch.get('clip_inside', dist.shape, bool))
+  rejected = np.any(~np.any(inside, 2), 0)
+  clipped = ~rejected & ~np.all(inside[4:], (0, 2))
+  pieces = np.where(rejected, 0, 1)
+  if stats.enabled:
+    stats.count('triangles_rejected', np.count_nonzero(rejected))
+    stats.count('triangles_clipped', np.count_nonzero(clipped))
+
+  if not np.any(clipped):
+    keep = np.flatnonzero(~rejected)
+    if scratch is None:
+      return (verts, tris[keep], colors[keep], keep)
+    return (verts,
+            np.take(tris, keep, 0, out=scratch.get(
+              'clip_tris', (len(keep),) + tris.shape[1:], tris.dtype)),
+            np.take(colors, keep, 0, out=scratch.get(
+              'clip_colors', (len(keep),) + colors.shape[1:], colors.dtype)),
+            keep)
+
+  # Clip the crossing triangles as polygons, and fan them back into
+  # triangles.  Pieces from polygon k are (0, i, i+1) for i = 1..n_k-2.
+  which = np.flatnonzero(clipped)
+  (polys, counts) = _clipPolygons(verts[:, tris[which]].transpose((1,2,0)),
+                                  planes[4:])
+  num_pieces = np.maximum(counts - 2, 0)
+  pieces[which] = num_pieces
+  used = np.arange(polys.shape[1]) < counts[:, None]
+  new_verts = polys[used].T
+  base = verts.shape[1] + np.cumsum(counts) - counts
+  fan = np.repeat(np.arange(len(which)), num_pieces)
+  i = (np.arange(len(fan)) -
+       np.repeat(np.cumsum(num_pieces) - num_pieces, num_pieces) + 1)
+  fan_tris = base[fan][:, None] + np.stack((np.zeros_like(i), i, i + 1), 1)
+
+  # Interleave the pieces with the untouched triangles, in order.
+  source = np.repeat(np.arange(num_tris), pieces)
+  out_tris = tris[source]
+  out_tris[clipped[source]] = fan_tris
+  return (np.concatenate((verts, new_verts), 1), out_tris, colors[source],
+          source)
+
+def clipSegments(verts, edges, colors, stats=render_stats.NO_STATS):
+  """Clips line segments to the near plane, in homogeneous clip space.
+
+  Arguments:
+   - verts (4xN): the clip-space coordinates of N vertices.
+   - edges (Ex2): the indices into verts of the endpoints of E segments.
+   - colors (Ex3): the color of each segment.
+   - stats (optional): a RenderStats object to count segments into.
+
+  Returns (verts, edges, colors), as for clipTriangles(): segments wholly
+  on the camera's side of the near plane are dropped, and each one that
+  crosses it is cut short at a new vertex appended to verts.  Only the
+  near plane is used: that's all it takes for every endpoint to have
+  w > 0, and the line rasterizer clips the rest to the screen itself.
+  """
+  d = _clipPlanes(0)[4].dot(verts)[edges]  # Ex2
+  inside = d >= 0
+  crossing = inside[:, 0] != inside[:, 1]
+  keep = np.flatnonzero(np.any(inside, 1))
+  if stats.enabled:
+    stats.count('edges_rejected', edges.shape[0] - len(keep))
+    stats.count('edges_clipped', np.count_nonzero(crossing))
+  if not np.any(crossing):
+    return (verts, edges[keep], colors[keep])
+
+  # Measure each crossing point from the segment's inside end, as in
+  # _clipPolygons().
+  which = np.flatnonzero(crossing)
+  j = np.where(inside[which, 0], 0, 1)
+  a = edges[which, j]
+  b = edges[which, 1 - j]
+  (da, db) = (d[which, j], d[which, 1 - j])
+  t = da / (da - db)
+  new_verts = verts[:, a] + t * (verts[:, b] - verts[:, a])
+  edges = edges.copy()
+  edges[which, 1 - j] = verts.shape[1] + np.arange(len(which))
+  return (np.concatenate((verts, new_verts), 1), edges[keep], colors[keep])
+
+def _clipPlanes(guard_band):
+  """Returns the clip-space planes used by clipTriangles(), as a 10x4.
+
+  A point p is inside plane q when q.dot(p) >= 0.  The rows are the
+  screen's left, right, bottom, and top sides, then the near and far
+  planes, then the guard band's left, right, bottom, and top sides.
+  """
+  g = float(guard_band)
+  return np.array([[1, 0, 0, 1], [-1, 0, 0, 1],
+                   [0, 1, 0, 1], [0, -1, 0, 1],
+                   [0, 0, -1, 1], [0, 0, 1, 1],
+                   [1, 0, 0, g], [-1, 0, 0, g],
+                   [0, 1, 0, g], [0, -1, 0, g]], dtype=float)
+
+def _clipPolygons(polys, planes):
+  """Clips convex polygons against planes (Sutherland-Hodgman).
+
+  Arguments:
+   - polys (KxMx4): K polygons of M vertices each, in clip space.
+   - planes (Px4): the planes to clip against; see _clipPlanes().
+
+  Returns (polys, counts): a Kx(M+P)x4 array of the clipped polygons, and
+  the number of vertices in each (which may be fewer than 3, if nothing
+  is left).  All the polygons are clipped against one plane at a time, in
+  array operations, so there's no per-polygon Python loop.
+  """
+  (K, M) = polys.shape[:2]
+  counts = np.repeat(M, K)
+  rows = np.arange(K)
+  for plane in planes:
+    d = polys.dot(plane)
+    out = np.zeros((K, M + 1, 4))
+    n = np.zeros(K, dtype=int)
+    for j in range(M):
+      valid = j < counts
+      nxt = (j + 1) % np.maximum(counts, 1)
+      (p, q) = (polys[:, j], polys[rows, nxt])
+      (dp, dq) = (d[:, j], d[rows, nxt])
+      p_in = dp >= 0
+      q_in = dq >= 0
+      # Keep each inside vertex.
+      emit = valid & p_in
+      out[rows[emit], n[emit]] = p[emit]
+      n += emit
+      # Add the crossing point of each edge that crosses the plane.  It's
+      # always measured from the edge's inside end, so the two triangles
+      # sharing an edge get exactly the same point.
+      emit = valid & (p_in != q_in)
+      (a, b, da, db) = (np.where(p_in[:, None], p, q),
+                        np.where(p_in[:, None], q, p),
+                        np.where(p_in, dp, dq), np.where(p_in, dq, dp))
+      with np.errstate(invalid='ignore', divide='ignore'):
+        t = da / (da - db)
+        out[rows[emit], n[emit]] = (a + t[:, None] * (b - a))[emit]
+      n += emit
+    (polys, counts, M) = (out, n, M + 1)
+  return (polys, counts)
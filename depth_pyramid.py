@@ -0,0 +1,162 @@
+"""
+depth_pyramid --- Hierarchical-Z occlusion culling.
+
+In a scene where most of the geometry is hidden behind a few big things
+(the floor seen from underneath, say), the rasterizer spends most of its
+time generating fragments that then fail the z-test.  A DepthPyramid lets
+us skip those triangles without touching their pixels.  It is a mip chain
+of the z-buffer in which each texel of level k holds the depth of the
+farthest pixel in its 2^k x 2^k block.  (Larger z is nearer, so that's the
+minimum.)  Anything whose nearest point is farther than that, over the
+whole of its screen box, is hidden; and at the right level, the box only
+covers 2x2 texels, so the test is four lookups no matter how big it is.
+
+drawFrontToBack() puts it to work: it draws the instances of a scene
+nearest first, in batches, refreshing the pyramid after each batch, and
+drops every instance and triangle the pyramid says is hidden by what's
+already been drawn.
+"""
+import numpy as np
+import render_stats
+
+# A little depth slack, so that rounding in the rasterizers' depth
+# interpolation can't push a fragment in front of the nearest vertex that
+# the occlusion test went by.
+DEPTH_SLACK = 1e-9
+
+class DepthPyramid(object):
+  """A max-depth (that is, minimum z) mip chain of a z-buffer.
+
+  Public attributes:
+   - levels: a list of 2-D arrays.  levels[0] is the z-buffer itself, and
+     each level after that is half the size of the one before (rounding
+     up), down to 1x1.
+  """
+
+  def __init__(self, z_buf):
+    """Builds the pyramid for a WxH z-buffer (which it keeps a view of)."""
+    self.levels = [z_buf]
+    while self.levels[-1].size > 1:
+      self.levels.append(_halve(self.levels[-1]))
+
+  def update(self):
+    """Rebuilds the pyramid from the current contents of the z-buffer."""
+    for k in range(1, len(self.levels)):
+      self.levels[k] = _halve(self.levels[k-1])
+
+  def occluded(self, boxes, near):
+    """Tests whether screen boxes are hidden behind the z-buffer.
+
+    Arguments:
+     - boxes: a 4-tuple (min_a, max_a, min_b, max_b) of length-K arrays,
+       the inclusive pixel ranges of K nonempty boxes in the image.
+     - near (length K): the nearest (largest) z of anything in each box.
+
+    Returns a length-K boolean array, True for each box whose near depth
+    is strictly farther than every pixel of the z-buffer inside it, so that
+    nothing in the box could pass the z-test.
+    """
+    (min_a, max_a, min_b, max_b) = boxes
+    # The level at which each box spans at most 2x2 texels.
+    span = np.maximum(max_a - min_a, max_b - min_b)
+    level = np.ceil(np.log2(np.maximum(span, 1))).astype(int)
+    level = np.minimum(level, len(self.levels) - 1)
+    far = np.empty(len(near), dtype=self.levels[0].dtype)
+    for k in np.unique(level):
+      i = np.flatnonzero(level == k)
+      z = self.levels[k]
+      (w, h) = z.shape
+      a0 = np.minimum(min_a[i] >> k, w - 1)
+      a1 = np.minimum(max_a[i] >> k, w - 1)
+      b0 = np.minimum(min_b[i] >> k, h - 1)
+      b1 = np.minimum(max_b[i] >> k, h - 1)
+      far[i] = np.minimum(np.minimum(z[a0, b0], z[a1, b0]),
+                          np.minimum(z[a0, b1], z[a1, b1]))
+    # The rasterizers round fragment depths to the z-buffer's precision
+    # before testing them, so round the near depths the same way.
+    near = (np.asarray(near, dtype=float) + DEPTH_SLACK).astype(far.dtype)
+    return near < far
+
+
+def _halve(z):
+  """Returns the minima of the 2x2 blocks of a 2-D array.
+
+  An odd last row or column is a block of its own.
+  """
+  for axis in (0, 1):
+    z = np.swapaxes(z, 0, axis)
+    (even, odd) = (z[0::2], z[1::2])
+    z = np.concatenate((np.minimum(even[:len(odd)], odd),
+                        even[len(odd):]), 0)
+    z = np.swapaxes(z, 0, axis)
+  return z
+
+def drawFrontToBack(boxes, near, inst, z_buf, draw,
+                    stats=render_stats.NO_STATS):
+  """Draws triangles instance by instance, nearest first, with occlusion.
+
+  Arguments:
+   - boxes: a 4-tuple (min_a, max_a, min_b, max_b) of length-T arrays, the
+     pixel bounding boxes of T triangles, as from _pixelBoundingBox() in
+     projection_renderer.  Triangles with empty boxes are never drawn.
+   - near (length T): the nearest (largest) z of each triangle's corners.
+   - inst (length T): the instance each triangle belongs to.
+   - z_buf (WxH): the z-buffer that draw() draws into.
+   - draw: a function called as draw(indices) to rasterize some of the
+     triangles, given a sorted 1-D array of their indices.
+   - stats (optional): a RenderStats object to count culled instances and
+     triangles into.
+
+  The instances are sorted by their nearest depth, and drawn in batches of
+  1, 2, 4, ... instances, so the pyramid is only rebuilt a logarithmic
+  number of times.  Before each batch after the first, the instances, and
+  then the triangles of the ones left, are tested against the pyramid, and
+  those that are hidden are dropped.  The test is conservative: it only
+  drops what couldn't have passed the z-test anyway.  Within a batch, the
+  triangles are drawn in their original order.
+  """
+  (min_a, max_a, min_b, max_b) = boxes
+  live = np.flatnonzero((max_a >= min_a) & (max_b >= min_b))
+  if len(live) == 0:
+    return
+
+  # Group the live triangles by instance, with each instance's overall
+  # screen box and nearest depth.
+  with stats.stage('occlusion'):
+    which = np.unique(inst[live], return_inverse=True)[1]
+    live = live[np.argsort(which, kind='mergesort')]
+    counts = np.bincount(which)
+    starts = np.cumsum(counts) - counts
+    members = np.split(live, starts[1:])
+    inst_boxes = [ufunc.reduceat(edge[live], starts)
+                  for (edge, ufunc) in ((min_a, np.minimum),
+                                        (max_a, np.maximum),
+                                        (min_b, np.minimum),
+                                        (max_b, np.maximum))]
+    inst_near = np.maximum.reduceat(near[live], starts)
+    order = np.argsort(-inst_near, kind='mergesort')
+    pyramid = DepthPyramid(z_buf)
+
+  (start, size) = (0, 1)
+  while start < len(order):
+    group = order[start:start + size]
+    with stats.stage('occlusion'):
+      if start > 0:
+        pyramid.update()
+        hidden = pyramid.occluded([b[group] for b in inst_boxes],
+                                  inst_near[group])
+        if stats.enabled:
+          stats.count('instances_occluded', np.count_nonzero(hidden))
+          stats.count('triangles_occluded', np.sum(counts[group[hidden]]))
+        group = group[~hidden]
+      sel = np.sort(np.concatenate([members[i] for i in group] +
+                                   [np.empty(0, dtype=int)]))
+      if start > 0 and len(sel) > 0:
+        hidden = pyramid.occluded([b[sel] for b in boxes], near[sel])
+        if stats.enabled:
+          stats.count('triangles_occluded', np.count_nonzero(hidden))
+        sel = sel[~hidden]
+    if len(sel) > 0:
+      with stats.stage('raster'):
+        draw(sel)
+    (start, size) = (start + size, 2*size)
@@ -0,0 +1,202 @@
+"""
+flat_scene --- A flattened, array-backed representation of a scene.
+
+A scenegraph is a handy way to build and pose a scene, but a poor one to
+render from: every frame means walking Python objects.  A FlatScene is
+compiled from a scenegraph (or from a list of instances) into a handful of
+arrays:
+
+ - xforms (Ix4x4): the composite transform of each of the I instances.
+ - mesh_ids (length I): which unique mesh each instance uses.
+ - colors (Ix3): the surface color of each instance.
+ - instance_ids (length I): the index of each instance in the scenegraph's
+   full list of instances (see RootNode.getCompositeArrays()).  These are
+   just 0, ..., I-1 unless some instances were culled away.
+ - verts (4xV), tris (Tx3): the vertex and triangle buffers of all the
+   unique meshes, concatenated.  The triangles index into verts directly.
+   vert_offsets and tri_offsets (length M+1) say where each of the M meshes
+   starts and ends in them.
+
+plus an instance-expanded index layout.  Instances of the same mesh are
+grouped together in the expanded vertex buffer, so each group is transformed
+with one batched matrix product, and the triangles of every instance
+(inst_tris, in instance order, with tri_inst giving each one's instance)
+index into that shared buffer rather than carrying copies of their corners.
+
+Usage:
+  flat = flattenScene(root)
+  cam_verts = flat.transformVerts(world_to_camera)   # 4x(total verts)
+  cam_verts[:, flat.inst_tris[t]]                     # triangle t
+
+When only the transforms or colors of a scene change from frame to frame
+(see the setters on the scenegraph's transform nodes), flat.refresh(root)
+updates the arrays without rebuilding the buffers.
+"""
+import numpy as np
+
+class FlatScene(object):
+  """A scene, compiled into stacked arrays for rendering.
+
+  See the module documentation for the public attributes.  In addition,
+  shapes and surfs are the lists of ShapeNode and SurfaceNode objects for
+  each instance, for mapping results back onto the scenegraph.
+  """
+
+  def __init__(self, xforms, shapes, surfs, instance_ids=None):
+    """Builds a FlatScene from per-instance data.
+
+    Arguments:
+     - xforms (Ix4x4 numpy array): the composite transform of each instance.
+     - shapes: a list of the I ShapeNode objects.
+     - surfs: a list of the I SurfaceNode objects.
+     - instance_ids (optional): the instance_ids attribute (see above).
+    The first three are exactly the three things returned by
+    RootNode.getCompositeArrays(), and all four are the four things
+    returned by RootNode.getVisibleArrays().
+    """
+    # Find the unique meshes.  Two ShapeNodes with the same vertex and
+    # triangle arrays count as the same mesh.
+    self.meshes = []
+    index = {}
+    mesh_ids = []
+    for s in shapes:
+      (verts, tris) = s.mesh
+      key = (id(verts), id(tris))
+      if key not in index:
+        index[key] = len(self.meshes)
+        self.meshes.append((verts, tris))
+      mesh_ids.append(index[key])
+    self.mesh_ids = np.array(mesh_ids, dtype=int)
+
+    # Concatenate the mesh buffers.
+    nv = [v.shape[1] for (v, _t) in self.meshes]
+    nt = [t.shape[0] for (_v, t) in self.meshes]
+    self.vert_offsets = np.concatenate(([0], np.cumsum(nv))).astype(int)
+    self.tri_offsets = np.concatenate(([0], np.cumsum(nt))).astype(int)
+    self.verts = np.concatenate(
+      [np.asarray(v, dtype=float) for (v, _t) in self.meshes] +
+      [np.empty((4, 0))], 1)
+    self.tris = np.concatenate(
+      [np.asarray(t, dtype=int) + self.vert_offsets[m]
+       for (m, (_v, t)) in enumerate(self.meshes)] +
+      [np.empty((0, 3), dtype=int)], 0)
+
+    # Lay out every instance's copy of its mesh in an instance-expanded
+    # vertex buffer.  The buffer is grouped by mesh: all the instances of
+    # mesh m are side by side in one block, starting at group_offsets[m], so
+    # that the whole block can be transformed with one batched matrix
+    # product.  inst_vert_base[i] is where instance i's vertices start.
+    nv = np.diff(self.vert_offsets)
+    self._groups = [np.flatnonzero(self.mesh_ids == m)
+                    for m in range(len(self.meshes))]
+    group_sizes = np.array([len(g) for g in self._groups], dtype=int) * nv
+    self.group_offsets = np.concatenate(([0], np.cumsum(group_sizes)))
+    self.group_offsets = self.group_offsets.astype(int)
+    self.inst_vert_base = np.zeros(len(shapes), dtype=int)
+    for (m, g) in enumerate(self._groups):
+      self.inst_vert_base[g] = self.group_offsets[m] + nv[m]*np.arange(len(g))
+
+    # Triangles stay in instance order.  tri_inst[t] is the instance of
+    # expanded triangle t, and inst_tris[t,:] are its corners' indices in
+    # the expanded vertex buffer.
+    inst_nt = np.diff(self.tri_offsets)[self.mesh_ids]
+    self.inst_tri_offsets = np.concatenate(([0], np.cumsum(inst_nt)))
+    self.inst_tri_offsets = self.inst_tri_offsets.astype(int)
+    self.tri_inst = np.repeat(np.arange(len(shapes)), inst_nt)
+    tri_src = (np.arange(self.inst_tri_offsets[-1]) -
+               self.inst_tri_offsets[self.tri_inst] +
+               self.tri_offsets[self.mesh_ids][self.tri_inst])
+    self.inst_tris = (self.tris[tri_src] -
+                      self.vert_offsets[self.mesh_ids][self.tri_inst][:,None] +
+                      self.inst_vert_base[self.tri_inst][:,None])
+
+    self._setInstances(xforms, shapes, surfs, instance_ids)
+
+  def refresh(self, root):
+    """Updates this FlatScene to match a (possibly changed) scenegraph.
+
+    If the scenegraph still has the same instances of the same shapes, in
+    the same order, and the shapes still have the same meshes, only the
+    transforms and colors are updated.  Otherwise the whole FlatScene is
+    rebuilt.
+    """
+    (xforms, shapes, surfs) = root.getCompositeArrays()
+    if (len(shapes) == len(self.shapes) and
+        all(a is b for (a, b) in zip(shapes, self.shapes)) and
+        all(s.mesh[0] is self.meshes[m][0] and s.mesh[1] is self.meshes[m][1]
+            for (s, m) in zip(shapes, self.mesh_ids))):
+      self._setInstances(xforms, shapes, surfs)
+    else:
+      self.__init__(xforms, shapes, surfs)
+
+  def _setInstances(self, xforms, shapes, surfs, instance_ids=None):
+    if instance_ids is None:
+      instance_ids = np.arange(len(shapes))
+    self.instance_ids = np.asarray(instance_ids, dtype=int)
+    self.xforms = np.asarray(xforms, dtype=float).reshape(-1, 4, 4)
+    self.shapes = list(shapes)
+    self.surfs = list(surfs)
+    self.colors = np.array([s.color for s in self.surfs],
+                           dtype=float).reshape(-1, 3)
+
+  def numInstances(self):
+    """Returns the number of instances, I."""
+    return len(self.shapes)
+
+  def numTriangles(self):
+    """Returns the total number of triangles over all instances."""
+    return self.inst_tris.shape[0]
+
+  def numVerts(self):
+    """Returns the total number of vertices over all instances."""
+    return self.group_offsets[-1]
+
+  def transformVerts(self, M=None, out=None):
+    """Transforms the vertices of every instance.
+
+    Arguments:
+     - M (optional): a 4x4 transform to apply after each instance's own
+       transform, e.g. a world-to-camera transform.
+     - out (optional): a 4xN array to write the result into.
+
+    Returns a 4xN array for the N vertices of all the instances, laid out
+    so that inst_tris indexes into it.  Each unique mesh is transformed
+    for all of its instances with a single (batched) matrix product.
+    Without M, this gives exactly what np.dot(xforms[i], verts) gives for
+    each instance.  The composite transforms themselves come from the
+    scenegraph's cache, whose products are associated differently from the
+    original traversal, so renders can differ from the original ones by
+    about one ulp, and sometimes by a pixel.
+    """
+    mats = self.xforms if M is None else np.matmul(M, self.xforms)
+    if out is None:
+      out = np.empty((4, self.numVerts()))
+    for (m, g) in enumerate(self._groups):
+      if len(g) == 0:
+        continue
+      (v0, v1) = self.vert_offsets[m:m+2]
+      (o0, o1) = self.group_offsets[m:m+2]
+      # (n)x4x4 times 4xV is (n)x4xV; we want 4x(nV), instance-major.
+      out[:, o0:o1] = np.matmul(mats[g], self.verts[:, v0:v1]).transpose(
+        (1,0,2)).reshape(4, -1)
+    return out
+
+
+def flattenScene(root, camera=None):
+  """Returns a FlatScene for the scenegraph rooted at root (a RootNode).
+
+  If a camera is given, instances entirely outside its view frustum are
+  left out (see RootNode.getVisibleArrays()).
+  """
+  if camera is None:
+    return FlatScene(*root.getCompositeArrays())
+  return FlatScene(*root.getVisibleArrays(camera.frustumPlanes()))
+
+def flattenInstances(instances):
+  """Returns a FlatScene for a list of (inst_xform, node, surf) tuples.
+
+  The list is in the format of RootNode.getCompositeTransforms().
+  """
+  xforms = np.array([x for (x, _n, _s) in instances]).reshape(-1, 4, 4)
+  return FlatScene(xforms, [n for (_x, n, _s) in instances],
+                   [s for (_x, _n, s) in instances])
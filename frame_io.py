@@ -0,0 +1,236 @@
+"""
+frame_io --- Writing rendered frames to disk, with no plotting library.
+
+The writers here take an image as renderRaster() returns it (a WxHx3 array
+of floats in [0,1], indexed [x,y] with y going up), or a Framebuffer, and
+store it as 8-bit RGB in one of a few simple formats:
+
+ - writePPM(): binary PPM ("P6"), which almost anything can read.
+ - writePAM(): PAM ("P7"), the same with a self-describing header.
+ - writeRaw(): just the pixels, row by row from the top, 3 bytes each.
+ - writePNG(): PNG, compressed with zlib; no imaging library needed.
+ - writeFrame(): any of the above, chosen by the file name's extension.
+
+For long animations, RawFrameSequence keeps every frame in one memory-
+mapped file, growing it as frames are appended, so a whole sequence can be
+written (or read back) without ever holding more than one frame in memory.
+"""
+import struct
+import zlib
+import numpy as np
+
+def writeFrame(path, img):
+  """Writes an image to a file, in the format its extension says.
+
+  The extension must be one of .ppm, .pam, .png, or .raw (in any case).
+  See toRows() for what img can be.
+  """
+  ext = path.rsplit('.', 1)[-1].lower()
+  if ext not in WRITERS:
+    raise ValueError("Unknown image format '%s'." % ext)
+  WRITERS[ext](path, img)
+
+def writePPM(path, img):
+  """Writes an image to a binary PPM file.  See toRows() about img."""
+  rows = toRows(img)
+  (H, W) = rows.shape[:2]
+  with open(path, 'wb') as f:
+    f.write(("P6\n%d %d\n255\n" % (W, H)).encode('ascii'))
+    f.write(rows.tobytes())
+
+def writePAM(path, img):
+  """Writes an image to a PAM file.  See toRows() about img."""
+  rows = toRows(img)
+  (H, W) = rows.shape[:2]
+  header = ("P7\nWIDTH %d\nHEIGHT %d\nDEPTH 3\nMAXVAL 255\n"
+            "TUPLTYPE RGB\nENDHDR\n" % (W, H))
+  with open(path, 'wb') as f:
+    f.write(header.encode('ascii'))
+    f.write(rows.tobytes())
+
+def writeRaw(path, img):
+  """Writes an image's pixels, with no header.  See toRows() about img.
+
+  The file is H rows of W pixels, from the top left, 3 bytes (R, G, B) per
+  pixel.  The reader has to know W and H.
+  """
+  with open(path, 'wb') as f:
+    f.write(toRows(img).tobytes())
+
+def writePNG(path, img, level=6):
+  """Writes an image to a PNG file.  See toRows() about img.
+
+  Argument level (optional; default 6) is the zlib compression level, from
+  1 (fastest) to 9 (smallest).  Every row is stored unfiltered, which
+  compresses well enough for rendered images and keeps this quick.
+  """
+  rows = toRows(img)
+  (H, W) = rows.shape[:2]
+  # Each row of the image data starts with its filter type: 0, for none.
+  data = np.zeros((H, 1 + 3*W), dtype=np.uint8)
+  data[:, 1:] = rows.reshape(H, 3*W)
+  with open(path, 'wb') as f:
+    f.write(b'\x89PNG\r\n\x1a\n')
+    # Width, height, bit depth 8, color type 2 (RGB), and the default
+    # compression, filter, and interlace methods.
+    _writeChunk(f, b'IHDR', struct.pack('>IIBBBBB', W, H, 8, 2, 0, 0, 0))
+    _writeChunk(f, b'IDAT', zlib.compress(data.tobytes(), level))
+    _writeChunk(f, b'IEND', b'')
+
+def _writeChunk(f, kind, payload):
+  f.write(struct.pack('>I', len(payload)))
+  f.write(kind)
+  f.write(payload)
+  f.write(struct.pack('>I', zlib.crc32(kind + payload) & 0xffffffff))
+
+WRITERS = {'ppm': writePPM, 'pam': writePAM, 'png': writePNG, 'raw': writeRaw}
+
+def toRows(img):
+  """Converts an image to the row order of image files.
+
+  Argument img is a WxHx3 numpy array indexed [x,y], with y going up: either
+  floats in [0,1], as renderRaster() returns, or uint8.  It may also be a
+  Framebuffer.  Returns a contiguous HxWx3 uint8 array whose first row is
+  the top of the image.
+  """
+  if hasattr(img, 'toUint8'):
+    img = img.toUint8()
+  elif img.dtype != np.uint8:
+    img = np.round(np.clip(img, 0, 1) * 255).astype(np.uint8)
+  return np.ascontiguousarray(img.transpose((1,0,2))[::-1])
+
+
+class RawFrameSequence(object):
+  """A sequence of same-sized frames, stored in one memory-mapped file.
+
+  The file has a 32-byte header (a magic string, the frame width and
+  height, and the number of frames) followed by each frame's pixels as for
+  writeRaw().  Frames are written straight into the mapped file, which
+  grows as needed, so appending doesn't hold earlier frames in memory.
+
+  Usage:
+    seq = RawFrameSequence('frames.raw', 'w', 300, 200)
+    for img in images:
+      seq.append(img)
+    seq.close()
+
+    seq = RawFrameSequence('frames.raw')
+    rows = seq[10]             # HxWx3 uint8, top row first
+    for img in seq.images():   # WxHx3 floats, like renderRaster()'s
+      ...
+  """
+  MAGIC = b'RAWFRAME'
+  HEADER_SIZE = 32
+
+  def __init__(self, path, mode='r', width=None, height=None):
+    """Opens a frame sequence file.
+
+    Arguments:
+     - path: the file name.
+     - mode (optional; default 'r'): 'r' to read an existing sequence, 'a'
+       to append to one, or 'w' to create a new one (replacing any file
+       already there).
+     - width, height: the frame size, in pixels.  Required for 'w'.
+    """
+    if mode not in ('r', 'a', 'w'):
+      raise ValueError("Unknown mode '%s'." % mode)
+    self.path = path
+    self.mode = mode
+    if mode == 'w':
+      if width is None or height is None:
+        raise ValueError("A new frame sequence needs a width and height.")
+      (self.width, self.height, self._count) = (width, height, 0)
+      with open(path, 'wb') as f:
+        f.write(self._header())
+    else:
+      with open(path, 'rb') as f:
+        header = f.read(self.HEADER_SIZE)
+      if header[:8] != self.MAGIC:
+        raise ValueError("'%s' isn't a raw frame sequence." % path)
+      (self.width, self.height, self._count) = struct.unpack(
+        '<IIQ', header[8:24])
+    self._map = None
+    self._mapFrames(self._count)
+
+  def __len__(self):
+    return self._count
+
+  def __getitem__(self, i):
+    """Returns frame i as an HxWx3 uint8 array (a view of the file)."""
+    if i < 0:
+      i += self._count
+    if not 0 <= i < self._count:
+      raise IndexError("Frame %d is out of range." % i)
+    return self._map[i]
+
+  def images(self):
+    """Yields each frame as a WxHx3 float image, like renderRaster()'s."""
+    for i in range(self._count):
+      yield self[i][::-1].transpose((1,0,2)) / 255.0
+
+  def append(self, img):
+    """Adds a frame to the end of the sequence.  See toRows() about img."""
+    if self.mode == 'r':
+      raise IOError("The frame sequence was opened for reading.")
+    rows = toRows(img)
+    if rows.shape != (self.height, self.width, 3):
+      raise ValueError("The frame is %dx%d, not %dx%d." % (
+        rows.shape[1], rows.shape[0], self.width, self.height))
+    if self._count == len(self._map):
+      # Grow the file by doubling, so appending stays cheap on average.
+      self._mapFrames(max(1, 2*self._count))
+    self._map[self._count] = rows
+    self._count += 1
+
+  def flush(self):
+    """Writes the frames and the frame count out to the file."""
+    if self.mode == 'r':
+      return
+    if isinstance(self._map, np.memmap):
+      self._map.flush()
+    with open(self.path, 'r+b') as f:
+      f.write(self._header())
+
+  def close(self):
+    """Flushes the sequence, and trims the file to just its frames."""
+    if self._map is None:
+      return
+    self.flush()
+    self._map = None
+    if self.mode != 'r':
+      with open(self.path, 'r+b') as f:
+        f.truncate(self.HEADER_SIZE + self._count * self._frameSize())
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    self.close()
+    return False
+
+  def _frameSize(self):
+    return self.width * self.height * 3
+
+  def _header(self):
+    header = self.MAGIC + struct.pack('<IIQ', self.width, self.height,
+                                      self._count)
+    return header + b'\0' * (self.HEADER_SIZE - len(header))
+
+  def _mapFrames(self, capacity):
+    """(Re)maps the file with room for capacity frames."""
+    if isinstance(self._map, np.memmap):
+      self._map.flush()
+    self._map = None
+    if self.mode != 'r':
+      with open(self.path, 'r+b') as f:
+        f.seek(0, 2)
+        if f.tell() < self.HEADER_SIZE + capacity * self._frameSize():
+          f.truncate(self.HEADER_SIZE + capacity * self._frameSize())
+    if capacity == 0:
+      # numpy can't map an empty region.
+      self._map = np.empty((0, self.height, self.width, 3), dtype=np.uint8)
+    else:
+      self._map = np.memmap(self.path, dtype=np.uint8,
+                            mode='r' if self.mode == 'r' else 'r+',
+                            offset=self.HEADER_SIZE,
+                            shape=(capacity, self.height, self.width, 3))
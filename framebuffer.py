@@ -0,0 +1,167 @@
+"""
+framebuffer --- Color and depth buffers for the raster renderer.
+
+A Framebuffer holds the two images that rasterization writes: a
+(width)x(height)x3 color buffer and a (width)x(height) depth buffer (the
+z-buffer), each with a configurable element type.  The defaults are compact:
+8-bit color and single-precision depth take 7 bytes per pixel, against 32
+for the float64 arrays that renderRaster() returns.
+
+Colors are stored in the buffer's own format, so the renderer converts the
+triangle colors once, with encodeColors(), before rasterizing, and every
+raster stage after that just copies them into place.  Converting the
+finished image back out is explicit:
+
+  fb = Framebuffer(1920, 1080)
+  renderRaster(scene, camera, 1920, 1080, framebuffer=fb)
+  img = fb.toFloat()     # WxHx3 float64 in [0,1], e.g. for drawImage()
+  png = fb.toUint8()     # WxHx3 uint8
+
+With uint8 color, toUint8() gives exactly what quantizing a float64 render
+gives, except that float32 depth can settle a few near-ties in depth the
+other way.  Float16 color is within one level of it.
+
+A GBuffer is the geometry buffer of deferred shading: instead of colors,
+it holds the depth and the ids of the triangle and the instance drawn at
+each pixel, in compact integer buffers.  Shading is then done afterwards,
+once per covered pixel, by looking up each pixel's triangle.
+"""
+import numpy as np
+
+# The background color, where nothing was drawn.
+BACKGROUND = (1.0, 1.0, 1.0)
+
+class Framebuffer(object):
+  """A color buffer and a depth buffer for one image.
+
+  Public attributes:
+   - width, height: the image size, in pixels.
+   - color ((width)x(height)x3 numpy array): the color buffer.
+   - depth ((width)x(height) numpy array): the depth buffer, in canonical
+     view z (larger is nearer), with -1 where nothing was drawn.
+  """
+
+  def __init__(self, width, height, color_dtype=np.uint8,
+               depth_dtype=np.float32, background=BACKGROUND, storage=None):
+    """Allocates a cleared Framebuffer.
+
+    Arguments:
+     - width, height: the image size, in pixels.
+     - color_dtype (optional; default uint8): the element type of the
+       color buffer: uint8 (0 to 255), or a floating-point type (0 to 1)
+       such as float16 or float64.
+     - depth_dtype (optional; default float32): the element type of the
+       depth buffer, a floating-point type.
+     - background (optional; default white): the RGB color, in [0,1], of
+       pixels where nothing is drawn.
+     - storage (optional): a pair (color, depth) of 1-D numpy arrays to
+       build the buffers in, instead of allocating new ones.  They must
+       have the two element types, and at least width*height*3 and
+       width*height elements.  (This is how a Renderer reuses its memory
+       from frame to frame.)
+    """
+    self.width = width
+    self.height = height
+    if storage is None:
+      self.color = np.empty((width, height, 3), dtype=color_dtype)
+      self.depth = np.empty((width, height), dtype=depth_dtype)
+    else:
+      (color, depth) = storage
+      if (color.dtype != color_dtype or depth.dtype != depth_dtype or
+          color.size < width*height*3 or depth.size < width*height):
+        raise ValueError("The storage doesn't fit a %dx%d framebuffer." %
+                         (width, height))
+      self.color = color[:width*height*3].reshape(width, height, 3)
+      self.depth = depth[:width*height].reshape(width, height)
+    if self.depth.dtype.kind != 'f':
+      raise ValueError("The depth buffer must have a floating-point type.")
+    self.background = np.asarray(background, dtype=float)
+    self.clear()
+
+  def clear(self):
+    """Resets every pixel to the background color and the far depth."""
+    self.color[...] = self.encodeColors(self.background)
+    self.depth.fill(-1)
+
+  def encodeColors(self, colors, out=None):
+    """Converts colors in [0,1] to the color buffer's format.
+
+    Argument colors is a numpy array whose last dimension is RGB (e.g. Tx3
+    for T triangles).  Returns an array of the same shape, with the color
+    buffer's element type: out, if it's given, or else a new one.  For
+    uint8, each channel is scaled to 0-255 and rounded to the nearest value.
+    """
+    colors = np.asarray(colors, dtype=float)
+    if self.color.dtype == np.uint8:
+      colors = np.round(np.clip(colors, 0, 1) * 255)
+    if out is None:
+      return colors.astype(self.color.dtype)
+    np.copyto(out, colors, casting='unsafe')
+    return out
+
+  def toFloat(self):
+    """Returns the color buffer as a new float64 array, in [0,1]."""
+    if self.color.dtype == np.uint8:
+      return self.color / 255.0
+    return self.color.astype(float)
+
+  def toUint8(self):
+    """Returns the color buffer as a new uint8 array, in [0,255]."""
+    if self.color.dtype == np.uint8:
+      return self.color.copy()
+    return np.round(np.clip(self.color, 0, 1) * 255).astype(np.uint8)
+
+  def nbytes(self):
+    """Returns the memory taken by the two buffers, in bytes."""
+    return self.color.nbytes + self.depth.nbytes
+
+
+class GBuffer(object):
+  """A depth buffer and triangle and instance id buffers for one image.
+
+  Public attributes:
+   - width, height: the image size, in pixels.
+   - depth ((width)x(height) numpy array): the depth buffer, as in a
+     Framebuffer.
+   - triangle_ids ((width)x(height) int32 array): the index of the
+     triangle drawn at each pixel, among all the triangles of the rendered
+     FlatScene (its inst_tris), or -1 where nothing was drawn.
+   - instance_ids ((width)x(height) int32 array): the index of the
+     instance drawn at each pixel, among all the instances of the
+     scenegraph (see RootNode.getCompositeArrays()), or -1.
+  """
+
+  def __init__(self, width, height, depth_dtype=np.float32, depth=None):
+    """Allocates a cleared GBuffer.
+
+    Arguments:
+     - width, height: the image size, in pixels.
+     - depth_dtype (optional; default float32): the element type of the
+       depth buffer, a floating-point type.
+     - depth (optional): a (width)x(height) array to use as the depth
+       buffer instead of allocating one, such as a Framebuffer's.
+    """
+    self.width = width
+    self.height = height
+    if depth is None:
+      depth = np.empty((width, height), dtype=depth_dtype)
+    elif depth.shape != (width, height):
+      raise ValueError("The depth buffer doesn't fit a %dx%d GBuffer." %
+                       (width, height))
+    if depth.dtype.kind != 'f':
+      raise ValueError("The depth buffer must have a floating-point type.")
+    self.depth = depth
+    self.triangle_ids = np.empty((width, height), dtype=np.int32)
+    self.instance_ids = np.empty((width, height), dtype=np.int32)
+    self.clear()
+
+  def clear(self):
+    """Resets every pixel to the far depth and no triangle."""
+    self.depth.fill(-1)
+    self.triangle_ids.fill(-1)
+    self.instance_ids.fill(-1)
+
+  def nbytes(self):
+    """Returns the memory taken by the three buffers, in bytes."""
+    return (self.depth.nbytes + self.triangle_ids.nbytes +
+            self.instance_ids.nbytes)
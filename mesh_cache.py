@@ -0,0 +1,137 @@
+"""
+mesh_cache --- Memoizing the mesh generators.
+
+The generators in meshes and our_shapes build their vertex and triangle
+arrays from scratch on every call, and scene.makeScene() calls them every
+time it builds a scene, which an animation does once per frame.  But a
+mesh only depends on the generator and its parameters, so it only needs
+to be built once:
+
+  (verts, tris) = mesh_cache.cachedMesh(meshes.sphere, 20)
+
+A MeshCache keeps the most recently used meshes in memory, up to a limit,
+and can also keep every mesh it builds in a directory of .npz files, so
+that they outlive the process.  The arrays it returns are shared between
+every caller, so they're read-only: copy one before changing it.
+"""
+import collections
+import os
+import re
+import numpy as np
+
+# How many meshes the shared cache keeps in memory.
+MAX_MESHES = 64
+
+class MeshCache(object):
+  """A bounded, least-recently-used cache of generated meshes.
+
+  Public attributes:
+   - max_meshes: how many meshes to keep in memory.
+   - directory: a directory to keep .npz copies of the meshes in, or None
+     to keep them in memory only.
+   - hits, misses: how many get() calls found their mesh already built, and
+     how many had to build it (or load it from the directory).
+  """
+
+  def __init__(self, max_meshes=MAX_MESHES, directory=None):
+    """Creates an empty MeshCache.
+
+    Arguments:
+     - max_meshes (optional; default MAX_MESHES): how many meshes to keep
+       in memory.
+     - directory (optional): a directory to keep .npz copies of the meshes
+       in.  It's created when the first mesh is saved.
+    """
+    self.max_meshes = max_meshes
+    self.directory = directory
+    self.hits = 0
+    self.misses = 0
+    self._meshes = collections.OrderedDict()
+
+  def get(self, generator, *args):
+    """Returns generator(*args), building it only if it isn't cached.
+
+    Arguments:
+     - generator: a mesh generator function, such as meshes.sphere or
+       our_shapes.doubleCone, which returns a 2-tuple (verts, tris).
+     - args: the generator's arguments.  They must be hashable, and they
+       (and the generator) must be all that the mesh depends on.
+
+    Returns the 2-tuple (verts, tris) as ShapeNode wants it: verts is
+    a 4xN array of homogeneous vertex positions (3xN vertices, as the
+    our_shapes generators return, get a row of ones added) and tris is Tx3.
+    Both are read-only, and the same arrays are returned for every call
+    with the same arguments, for as long as the mesh stays cached.
+    """
+    key = (generator.__module__, generator.__name__, args)
+    mesh = self._meshes.pop(key, None)
+    if mesh is None:
+      self.misses += 1
+      mesh = self._load(key)
+      if mesh is None:
+        mesh = _readOnly(generator(*args))
+        self._save(key, mesh)
+    else:
+      self.hits += 1
+    # The most recently used mesh goes at the end.
+    self._meshes[key] = mesh
+    while len(self._meshes) > self.max_meshes:
+      self._meshes.popitem(last=False)
+    return mesh
+
+  def clear(self):
+    """Forgets every mesh held in memory (but not those on disk)."""
+    self._meshes.clear()
+
+  def __len__(self):
+    return len(self._meshes)
+
+  def _path(self, key):
+    (module, name, args) = key
+    # The parameters become part of the file name, so keep it to
+    # characters that are safe in one.
+    params = re.sub(r'[^\w.+-]', '_', '_'.join(repr(a) for a in args))
+    return os.path.join(self.directory, '%s.%s_%s.npz' % (module, name, params))
+
+  def _load(self, key):
+    if self.directory is None:
+      return None
+    path = self._path(key)
+    if not os.path.exists(path):
+      return None
+    with np.load(path) as data:
+      return _readOnly((data['verts'], data['tris']))
+
+  def _save(self, key, mesh):
+    if self.directory is None:
+      return
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    # Write to a temporary file and then rename it, so a reader never sees
+    # a partly written mesh.
+    path = self._path(key)
+    temp = '%s.%d.tmp' % (path, os.getpid())
+    with open(temp, 'wb') as f:
+      np.savez(f, verts=mesh[0], tris=mesh[1])
+    os.rename(temp, path)
+
+
+def _readOnly(mesh):
+  """Returns a mesh as a homogeneous, read-only (verts, tris) pair."""
+  (verts, tris) = mesh
+  verts = np.array(verts)
+  if verts.shape[0] == 3:
+    verts = np.concatenate((verts, np.ones((1, verts.shape[1]))), 0)
+  tris = np.array(tris)
+  verts.flags.writeable = False
+  tris.flags.writeable = False
+  return (verts, tris)
+
+
+# The cache shared by cachedMesh().  Set its directory attribute to keep
+# the meshes on disk too.
+cache = MeshCache()
+
+def cachedMesh(generator, *args):
+  """Returns generator(*args) from the shared cache.  See MeshCache.get()."""
+  return cache.get(generator, *args)
@@ -12,6 +12,8 @@ def main():
   """
   Plots several 3D shapes in different octants of space.
   """
+  from gfx_helper_mayavi import setUpFigure, drawTriMesh, showFigure
+
   fig = setUpFigure()
 
   (cubeVerts, cubeTris) = cube()
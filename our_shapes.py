@@ -6,6 +6,8 @@ Comp 630, W' 16 at Phillips Academy.
 import numpy as np
 
 def main():
+  from gfx_helper_mayavi import setUpFigure, drawTriMesh, showFigure
+
   fig = setUpFigure()
 
   fxns = [trefoilKnot, banana, topToy, sword, coneWedge,
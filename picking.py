@@ -0,0 +1,80 @@
+"""
+picking --- Finding what was drawn at each pixel of a rendered image.
+
+To map a click (or any other image sample) back to the scenegraph, ask
+renderRaster() for a PickBuffer along with the image:
+
+  (img, picks) = renderRaster(scene, camera, 300, 200, picking=True)
+  hit = picks.pick(x, y)
+  if hit is not None:
+    (shape, surf, xform, triangle) = hit
+
+The PickBuffer's id buffers are filled in by the same render (it's drawn
+with deferred shading; see the framebuffer module's GBuffer), and each pick
+is a few array lookups, so there's no second pass and no guessing from
+colors.
+"""
+import numpy as np
+
+class PickBuffer(object):
+  """Which instance and triangle was drawn at each pixel of an image.
+
+  Public attributes:
+   - width, height: the image size, in pixels.
+   - instance_ids ((width)x(height) int32 array): the index of the
+     instance drawn at each pixel, in the order of the scenegraph's
+     RootNode.getCompositeTransforms(), or -1 where nothing was drawn.
+   - triangle_ids ((width)x(height) int32 array): the index of the
+     triangle drawn at each pixel within its instance's mesh (that is, a
+     row of the ShapeNode's tris array), or -1.
+   - depth ((width)x(height) numpy array): the depth buffer, in canonical
+     view z (larger is nearer), with -1 where nothing was drawn.
+  Like the image, all of them are indexed [x,y], with y going up.
+  """
+
+  def __init__(self, gbuffer, flat):
+    """Builds a PickBuffer from a rendered GBuffer.
+
+    Arguments:
+     - gbuffer: the GBuffer that a FlatScene was rendered into.
+     - flat: that FlatScene.
+    """
+    self.width = gbuffer.width
+    self.height = gbuffer.height
+    self.instance_ids = gbuffer.instance_ids
+    self.depth = gbuffer.depth
+    # The G-buffer's triangle ids index the FlatScene's triangles; make them
+    # relative to the start of each instance's triangles.
+    self.triangle_ids = np.empty_like(gbuffer.triangle_ids)
+    self.triangle_ids.fill(-1)
+    covered = gbuffer.triangle_ids >= 0
+    t = gbuffer.triangle_ids[covered]
+    self.triangle_ids[covered] = t - flat.inst_tri_offsets[flat.tri_inst[t]]
+
+    # The picked instances, by their index among the FlatScene's.  (The
+    # FlatScene may only hold the visible ones.)
+    self._xforms = flat.xforms
+    self._shapes = list(flat.shapes)
+    self._surfs = list(flat.surfs)
+    self._local = np.empty(np.amax(flat.instance_ids, initial=-1) + 1,
+                           dtype=int)
+    self._local[flat.instance_ids] = np.arange(len(flat.instance_ids))
+
+  def pick(self, x, y):
+    """Returns what was drawn at pixel (x,y) of the image.
+
+    Arguments x and y are pixel indices into the image, as in img[x,y].
+    Returns None if nothing was drawn there.  Otherwise, returns a 4-tuple
+    (shape, surf, xform, triangle): the instance's ShapeNode, its
+    SurfaceNode (or None), its 4x4 composite transform, and the index of
+    the triangle in the shape's mesh.
+    """
+    if not (0 <= x < self.width and 0 <= y < self.height):
+      raise IndexError("Pixel (%d, %d) is outside the %dx%d image." %
+                       (x, y, self.width, self.height))
+    i = self.instance_ids[x, y]
+    if i < 0:
+      return None
+    k = self._local[i]
+    return (self._shapes[k], self._surfs[k], self._xforms[k],
+            int(self.triangle_ids[x, y]))
@@ -8,6 +8,21 @@ By Jenny Huang
 """
 import numpy as np
 import camera
+import clipping
+import depth_pyramid
+import flat_scene
+from framebuffer import Framebuffer, GBuffer
+from picking import PickBuffer
+import render_stats
+
+# How close a point has to come to a triangle's edge, relative to the size
+# of the terms in the edge function, for _planeDepth() to leave it to
+# _baryDepth().
+EDGE_TOLERANCE = 1e-8
+
+# The pixel bounding box area at which renderDepth() rasterizes a triangle
+# on its own, rather than in a batch.
+BIG_TRIANGLE = 1024
 
 def perspectiveView(verts, inst_xform, world_to_view):
   """Transforms object-space points to canonical view coordinates.
@@ -25,7 +40,7 @@ def perspectiveView(verts, inst_xform, world_to_view):
   cam_verts = cam_verts/1.0/cam_verts[3]
   return cam_verts
 
-def plotLines(scene, camera, width, height):
+def plotLines(scene, camera, width, height, stats=None):
   """Plots a wireframe image of the camera's view of a scene.
 
   This function creates a new Matplotlib figure and plots lines in it,
@@ -37,24 +52,60 @@ def plotLines(scene, camera, width, height):
    - camera (Camera object): the camera whose view is to be rendered.
    - width: the width of the rendered scene.
    - height: the height of the rendered scene.
+   - stats (optional): a RenderStats object, or a function to be called
+     with one, to collect per-stage timings and counters.  (See the
+     render_stats module.)
 
   Note that if the ratio (width/height) doesn't match
   camera.naturalAspectRatio(), then the resulting image will be
   distorted.
   """
   import gfx_helper_script as helper
+  (stats, stats_callback) = render_stats.resolve(stats)
 
-  instances = scene.getCompositeTransforms()
-  world_to_view = camera.worldToCanonicalViewXform()
+  lines = wireframeLines(scene, camera, width, height, stats)
 
   fig = helper.plt.figure()
   ax = fig.add_subplot(1, 1, 1, aspect='equal')
   ax.set_xlim(-width/2.0, width/2.0)
   ax.set_ylim(-height/2.0, height/2.0)
 
+  for (cam_tris, color) in lines:
+    # When ax.plot is given two MxN arrays as its arguments, it sees these as
+    # the X and Y coordinates of N different curves, each of which is piecewise-
+    # linear connecting M points.  We exploit this to draw all T triangles
+    # in one call.
+    with stats.stage('plot'):
+      ax.plot(cam_tris[:,:,0], cam_tris[:,:,1], color=color)
+
+  if stats_callback is not None:
+    stats_callback(stats)
+
+  # Once we're done plotting all the triangles for all the instances...
+  helper.plt.show()
+
+def wireframeLines(scene, camera, width, height, stats=None):
+  """Computes the lines of a wireframe image of a scene.
+
+  This is the geometry half of plotLines(), with no plotting; the
+  arguments are the same.  Returns a list with one (cam_tris, color) pair
+  for each instance in the scene:
+   - cam_tris (4xTx2): cam_tris[i,t,:] are the image-space (x,y)
+     coordinates of vertex i on front-facing triangle t, with i=3
+     repeating vertex 0, scaled so that the image spans -width/2 to
+     width/2 and -height/2 to height/2.
+   - color: the instance's surface color.
+  """
+  (stats, stats_callback) = render_stats.resolve(stats)
+  with stats.stage('traverse'):
+    instances = scene.getCompositeTransforms()
+  world_to_view = camera.worldToCanonicalViewXform()
+
+  lines = []
   for (inst_xform, node, surf) in instances:
     (verts, tris) = node.mesh
-    cam_verts = perspectiveView(verts, inst_xform, world_to_view)
+    with stats.stage('project'):
+      cam_verts = perspectiveView(verts, inst_xform, world_to_view)
 
     # Now let's make a 4xTx2 array cam_tris.  cam_tris[i,t,:] are the image-
     # space (x,y) coordinates of vertex i on triangle t, with i=3 representing
@@ -62,65 +113,369 @@ def plotLines(scene, camera, width, height):
     #   We accomplish this by using tris to index into cam_verts, repeating
     # vertex #0 in each triangle.  The transpose rearranges the dimensions in
     # the order that we want.
-    cam_tris = cam_verts[:2, tris[:, [0,1,2,0]]].transpose((2,1,0))
+    with stats.stage('cull'):
+      cam_tris = cam_verts[:2, tris[:, [0,1,2,0]]].transpose((2,1,0))
 
-    # Remove triangles oriented clockwise in the image plane: these are the
-    # back-faces, and we don't want to draw them.
-    cam_tris = cam_tris[:, triangleNormals(cam_tris) > 0, :]
+      # Remove triangles oriented clockwise in the image plane: these are
+      # the back-faces, and we don't want to draw them.
+      cam_tris = cam_tris[:, triangleNormals(cam_tris) > 0, :]
 
-    # Scale cam_tris to the image size that the user requested.
-    cam_tris = cam_tris * np.array([width, height]).reshape((1,1,2))/2.0
+      # Scale cam_tris to the image size that the user requested.
+      cam_tris = cam_tris * np.array([width, height]).reshape((1,1,2))/2.0
+    if stats.enabled:
+      stats.count('triangles_in', tris.shape[0])
+      stats.count('triangles_culled', tris.shape[0] - cam_tris.shape[1])
 
-    # When ax.plot is given two MxN arrays as its arguments, it sees these as
-    # the X and Y coordinates of N different curves, each of which is piecewise-
-    # linear connecting M points.  We exploit this to draw all T triangles
-    # in one call.
-    ax.plot(cam_tris[:,:,0], cam_tris[:,:,1], color=surf.color)
+    lines.append((cam_tris, surf.color))
+  if stats_callback is not None:
+    stats_callback(stats)
+  return lines
 
-  # Once we're done plotting all the triangles for all the instances...
-  helper.plt.show()
+def renderWireframe(scene, camera, width, height, stats=None):
+  """Renders a wireframe image of the camera's view of a scene.
+
+  This draws the same lines as plotLines(), the edges of the front-facing
+  triangles in each instance's color, but straight into an image array,
+  with no plotting library.  An edge shared by two front-facing triangles
+  is only drawn once.  Where lines cross, the later instance's line is on
+  top, as in plotLines().  Unlike plotLines(), edges are clipped to the
+  near plane (see clipping.clipSegments()), so nothing nearer than that,
+  or behind the camera, is drawn.
+
+  The arguments are as for renderRaster() (scene may be a RootNode or a
+  FlatScene, and stats is optional), and so is the return value: a
+  (width)x(height)x3 numpy array, white where no line was drawn.
+  """
+  (stats, stats_callback) = render_stats.resolve(stats)
+  if not isinstance(scene, flat_scene.FlatScene):
+    with stats.stage('traverse'):
+      scene = flat_scene.flattenScene(scene)
+
+  with stats.stage('project'):
+    verts = scene.transformVerts(camera.worldToCanonicalViewXform())
+
+  with stats.stage('cull'):
+    # Keep the triangles that face the camera.  This is worked out before
+    # dividing by w, from the determinant of the corners' (x, y, w):
+    # wherever all three corners are in front of the camera, its sign is
+    # that of the normal in the image plane, which wireframeLines() tests,
+    # and it still means something where they aren't.
+    tris = scene.inst_tris
+    (x, y, w) = (verts[0, tris], verts[1, tris], verts[3, tris])
+    frontfaces = (x[:,0]*(y[:,1]*w[:,2] - y[:,2]*w[:,1]) +
+                  x[:,1]*(y[:,2]*w[:,0] - y[:,0]*w[:,2]) +
+                  x[:,2]*(y[:,0]*w[:,1] - y[:,1]*w[:,0])) > 0
+    tris = tris[frontfaces]
+
+    # List the three edges of each triangle, and keep only the first
+    # occurrence of each (unordered) pair of vertices.  Edges stay in
+    # triangle order, so later instances are still drawn later.
+    edges = tris[:, [0,1,1,2,2,0]].reshape(-1, 2)
+    key = np.amin(edges, 1) * verts.shape[1] + np.amax(edges, 1)
+    first = np.sort(np.unique(key, return_index=True)[1])
+    edges = edges[first]
+    colors = np.repeat(scene.colors[scene.tri_inst[frontfaces]], 3, 0)[first]
+
+  stats.count('triangles_in', frontfaces.shape[0])
+  stats.count('triangles_culled', frontfaces.shape[0] - tris.shape[0])
+
+  # Cut the edges off at the near plane before dividing by w, as
+  # renderRaster() does with triangles, so that no edge crossing behind
+  # the camera gets turned inside out.
+  with stats.stage('clip'):
+    (verts, edges, colors) = clipping.clipSegments(verts, edges, colors,
+                                                   stats=stats)
+  stats.count('edges_rasterized', edges.shape[0])
+  with stats.stage('project'):
+    verts = verts/1.0/verts[3]
+
+  img = np.ones((width, height, 3))
+  with stats.stage('raster'):
+    owner = rasterizeLines(verts, edges, colors, img)
+
+  if stats.enabled:
+    stats.count('pixels_touched', np.count_nonzero(owner >= 0))
+  if stats_callback is not None:
+    stats_callback(stats)
+  return img
 
-def renderRaster(scene, camera, width, height):
+def renderRaster(scene, camera, width, height, **options):
   """Renders a raster image of the camera's view of a scene.
 
   Arguments:
-   - scene (RootNode object): the root node of a scenegraph.
+   - scene (RootNode or FlatScene object): the root node of a scenegraph,
+     or a scene already compiled with flat_scene.flattenScene().
    - camera (Camera object): the camera whose view is to be rendered.
    - width: the width (number of pixels) of the rendered scene.
    - height: the height (number of pixels) of the rendered scene.
+   - engine (optional; default 'vector'): how triangles are rasterized.
+      * 'loop': the reference rasterizer, rasterizeTriangle(), which
+        visits each pixel of a triangle's bounding box in Python.
+      * 'vector': rasterizeTriangleVectorized(), which tests the whole
+        bounding box at once with array math.  Same image, much faster.
+      * 'batch': rasterizeTriangles(), which rasterizes all the triangles
+        in size-bucketed chunks of array operations, with no per-triangle
+        Python loop.  Same image; fastest for scenes with many small
+        triangles.
+   - processes (optional): if given, the image is cut into square screen
+     tiles, and the tiles are rasterized in parallel by this many worker
+     processes (see tile_renderer.rasterizeTiled()).  The image is the
+     same as the serial path's.  The engine argument is then ignored.
+   - tile_size (optional; default 128): the tile edge length, in pixels,
+     when processes is given.
+   - shading (optional; default incidenceShading): the shading function,
+     called as shading(colors, normals) with the Tx3 surface colors and
+     camera-space normals of the T front-facing triangles.  It must return
+     a Tx3 array of the colors to paint them.
+   - cull (optional; default True): whether to skip the instances that
+     are entirely outside the camera's view frustum, using the bounding
+     spheres cached in the scenegraph.  The image is the same either way.
+     (This only applies when scene is a RootNode.)
+   - stats (optional): a RenderStats object, or a function to be called
+     with one, to collect per-stage timings and counters.  (See the
+     render_stats module.)  Without it, no bookkeeping is done at all.
+   - framebuffer (optional): a (width)x(height) Framebuffer object to
+     render into, e.g. one with compact uint8 color and float32 depth.  It
+     is cleared first.  (See the framebuffer module.)
+   - scratch (optional): a renderer.ScratchPool to take the large
+     temporary arrays from, instead of allocating them.  (See the
+     renderer module, which sets this up for a sequence of frames.)
+   - occlusion (optional; default False): whether to skip the triangles
+     hidden behind ones already drawn, using a hierarchical z-buffer (see
+     the depth_pyramid module).  The instances are then drawn nearest
+     first.  The image is the same, except that where two instances'
+     fragments tie exactly in depth, the other one may win.  (This only
+     applies to the serial engines, not when processes is given.)
+   - front_to_back (optional; default False): whether to rasterize the
+     triangles nearest first (by their nearest corners), so that fewer of
+     them are drawn only to be drawn over.  The image is the same, except
+     that where two triangles tie exactly in depth, the other one may win.
+   - early_z (optional; default False): whether the serial engines test
+     each pixel's depth against the triangle's nearest corner before
+     interpolating anything there, so that pixels already covered by
+     something nearer cost next to nothing.  The image is the same.  This
+     pays off most together with front_to_back.
+   - deferred (optional; default False): whether to shade after
+     rasterizing rather than before.  The rasterizer then writes only
+     depths and triangle ids, into a GBuffer (see the framebuffer module),
+     and the shading function is called once, with the surface color and
+     normal of the triangle at each covered pixel, instead of once per
+     triangle.  So shading costs in proportion to the image size, not the
+     scene's.  The image is the same.
+   - gbuffer (optional): a (width)x(height) GBuffer to rasterize into,
+     which implies deferred.  It is cleared first, and afterward holds the
+     depth and the triangle and instance ids at each pixel.
+   - picking (optional; default False): whether to also return a
+     picking.PickBuffer, which says which instance, and which triangle of
+     its mesh, was drawn at each pixel, and whose pick(x,y) method returns
+     the ShapeNode, SurfaceNode, and composite transform drawn there.
+     This implies deferred.
 
   Note that if the ratio (width/height) doesn't match
   camera.naturalAspectRatio(), then the resulting image will be
   distorted.
 
   Returns a (width)x(height)x3 numpy array: a color image suitable
-  for plotting with gfx_helper_plotting.drawImage().
+  for plotting with gfx_helper_plotting.drawImage().  If a framebuffer
+  was given, though, the image is left in it, and the Framebuffer itself
+  is returned instead.  With picking, the return value is a pair: that,
+  and the PickBuffer.
+  """
+  (stats, stats_callback) = render_stats.resolve(options.pop('stats', None))
+  cull = options.pop('cull', True)
+  if not isinstance(scene, flat_scene.FlatScene):
+    with stats.stage('traverse'):
+      flat = flat_scene.flattenScene(scene, camera if cull else None)
+    if stats.enabled:
+      num_instances = len(scene.getCompositeArrays()[1])
+      stats.count('instances_in', num_instances)
+      stats.count('instances_culled', num_instances - flat.numInstances())
+    scene = flat
+  img = renderFlatScene(scene, camera, width, height, stats=stats, **options)
+  if stats_callback is not None:
+    stats_callback(stats)
+  return img
+
+def renderInstances(instances, camera, width, height, **options):
+  """Renders a raster image of the camera's view of some instances.
+
+  This is renderRaster() minus the scenegraph traversal: the first
+  argument is a list of (inst_xform, node, surf) tuples, as produced by
+  RootNode.getCompositeTransforms().  The other arguments and the return
+  value are exactly as for renderRaster().
+  """
+  (stats, stats_callback) = render_stats.resolve(options.pop('stats', None))
+  with stats.stage('traverse'):
+    flat = flat_scene.flattenInstances(instances)
+  img = renderFlatScene(flat, camera, width, height, stats=stats, **options)
+  if stats_callback is not None:
+    stats_callback(stats)
+  return img
+
+def renderDepth(scene, camera, width, height, linear=False, **options):
+  """Renders only the depth of the camera's view of a scene.
+
+  This is the z-buffer half of renderRaster(), for jobs that only need to
+  know how far away things are: nothing is shaded, and there's no color
+  buffer at all.  Only the Z component of each triangle's normal is
+  computed, for backface culling.  And with nothing to paint, the
+  rasterizers find each pixel's depth from the triangle's edge functions
+  (see _planeDepth()), rather than solving for it from scratch.
+
+  Arguments:
+   - scene, camera, width, height: as for renderRaster().
+   - linear (optional; default False): whether to return linear depths,
+     i.e. distances from the camera's plane along its view direction,
+     in world units, instead of canonical view z.
+   - engine (optional; default 'auto'): 'auto' rasterizes each triangle
+     whose pixel bounding box covers at least BIG_TRIANGLE pixels on its
+     own, with rasterizeTriangleVectorized(), and the rest in batches,
+     with rasterizeTriangles().  Otherwise, as for renderRaster().
+  The options cull, processes, tile_size, early_z, and stats are also as
+  for renderRaster().
+
+  Returns a (width)x(height) float32 array, indexed like renderRaster()'s
+  image.  By default it holds canonical view z, from 1 at the near plane
+  to -1 at the far plane (larger is nearer), with -1 where nothing was
+  drawn: the same as the depth buffer of a renderRaster() framebuffer
+  with float32 depth.  If linear is True, each value z becomes
+    2*far*near / ((far - near)*z + far + near),
+  which goes from near to far (larger is farther), and is far where
+  nothing was drawn.
+  """
+  (stats, stats_callback) = render_stats.resolve(options.pop('stats', None))
+  cull = options.pop('cull', True)
+  processes = options.pop('processes', None)
+  tile_size = options.pop('tile_size', 128)
+  early_z = options.pop('early_z', False)
+  engine = options.pop('engine', 'auto')
+  if options:
+    raise TypeError("Unknown option '%s'." % sorted(options)[0])
+  if isinstance(scene, flat_scene.FlatScene):
+    flat = scene
+  else:
+    with stats.stage('traverse'):
+      flat = flat_scene.flattenScene(scene, camera if cull else None)
+
+  with stats.stage('transform'):
+    verts = flat.transformVerts(camera.worldToCameraCentricXform())
+    tris = flat.inst_tris
+
+  with stats.stage('cull'):
+    # The Z component of each normal, with the same arithmetic as the full
+    # normals in indexedTriData(), so the same triangles face forward.
+    e1 = verts[:2, tris[:,1]] - verts[:2, tris[:,0]]
+    e2 = verts[:2, tris[:,2]] - verts[:2, tris[:,0]]
+    frontfaces = e1[0]*e2[1] - e1[1]*e2[0] > 0
+    tris = tris[frontfaces]
+  stats.count('triangles_in', frontfaces.shape[0])
+  stats.count('triangles_culled', frontfaces.shape[0] - tris.shape[0])
+
+  with stats.stage('project'):
+    verts = camera.perspectiveNormalizationXform().dot(verts)
+  with stats.stage('clip'):
+    (verts, tris, _colors, _source) = clipping.clipTriangles(
+      verts, tris, np.empty((tris.shape[0], 0)), stats=stats)
+  stats.count('triangles_rasterized', tris.shape[0])
+  with stats.stage('project'):
+    verts = verts/1.0/verts[3]
+
+  z_buf = np.empty((width, height), dtype=np.float32)
+  z_buf.fill(-1)
+  with stats.stage('raster'):
+    if processes is not None:
+      import tile_renderer
+      tile_renderer.rasterizeTiled(verts, tris, None, None, z_buf,
+                                   processes, tile_size, stats=stats)
+    elif engine == 'auto':
+      # Big triangles one at a time, and the rest in batches.  Depth is
+      # the same whatever order the triangles are drawn in.
+      (min_a, max_a, min_b, max_b) = _pixelBoundingBox(
+        verts[:2, tris].transpose((2,1,0)), width, height)
+      big = (max_a - min_a + 1) * (max_b - min_b + 1) >= BIG_TRIANGLE
+      _rasterizeAll('vector', verts, tris[big], None, None, z_buf, stats,
+                    early_z)
+      rasterizeTriangles(verts, tris[~big], None, None, z_buf, stats=stats,
+                         early_z=early_z)
+    else:
+      _rasterizeAll(engine, verts, tris, None, None, z_buf, stats, early_z)
+
+  if stats.enabled:
+    stats.count('pixels_touched', np.count_nonzero(z_buf > -1))
+  if linear:
+    (n, f) = (camera.near, camera.far)
+    z_buf[...] = 2*f*n / ((f - n)*z_buf.astype(float) + (f + n))
+  if stats_callback is not None:
+    stats_callback(stats)
+  return z_buf
+
+def renderFlatScene(flat, camera, width, height, engine='vector',
+                    processes=None, tile_size=128, shading=None, stats=None,
+                    framebuffer=None, scratch=None, occlusion=False,
+                    front_to_back=False, early_z=False, deferred=False,
+                    gbuffer=None, picking=False):
+  """Renders a raster image of the camera's view of a FlatScene.
+
+  This is where renderRaster() does its work; the arguments and the return
+  value are the same, except that the first argument must be a FlatScene.
   """
-  instances = scene.getCompositeTransforms()
+  if shading is None:
+    shading = incidenceShading
+  if framebuffer is None:
+    # A float64 framebuffer, whose color buffer we return as the image.
+    fb = Framebuffer(width, height, np.float64, np.float64)
+  elif (framebuffer.width, framebuffer.height) != (width, height):
+    raise ValueError("The framebuffer is %dx%d, not %dx%d." % (
+      framebuffer.width, framebuffer.height, width, height))
+  else:
+    fb = framebuffer
+    fb.clear()
+  if gbuffer is not None:
+    if (gbuffer.width, gbuffer.height) != (width, height):
+      raise ValueError("The G-buffer is %dx%d, not %dx%d." % (
+        gbuffer.width, gbuffer.height, width, height))
+    gbuffer.clear()
+    deferred = True
+  elif deferred or picking:
+    gbuffer = GBuffer(width, height, depth=fb.depth)
+    deferred = True
+  (stats, stats_callback) = render_stats.resolve(stats)
   world_to_camera = camera.worldToCameraCentricXform()
 
-  # Get vertices, colors, and normals of all triangles, transformed into the
-  # camera-centric coordinate system.  For T triangles overall, the shapes are:
-  #  - tri_verts: 3xTx4 (3 verts per triangle, T triangles, 4 coords per vert).
+  # Get vertices, triangles, colors, and normals, transformed into the
+  # camera-centric coordinate system.  For N vertices and T triangles
+  # overall, the shapes are:
+  #  - verts: 4xN (the vertices of every instance, in one shared buffer).
+  #  - tris: Tx3 (indices into verts of the three corners of each triangle).
   #  - colors: Tx3 (RGB triplet for each triangle).
   #  - normals: Tx3 (<x,y,z> vector for each triangle).  Note that the length
   #    of each normal vector is equal to twice the area of that triangle.
-  (tri_verts, colors, normals) = allTriData(instances, world_to_camera)
+  with stats.stage('transform'):
+    (verts, tris, colors, normals) = indexedTriData(flat, world_to_camera,
+                                                    scratch)
 
   # Since we're in a camera-centric coordinate system, only a triangle whose
   # normal vector has a positive Z component is facing toward the camera.
   # frontfaces will therefore be a length-T 1-D array of booleans, where an
   # entry is True only if that triangle faces toward the camera.
-  frontfaces = normals[:,2] > 0
+  with stats.stage('cull'):
+    if scratch is None:
+      frontfaces = normals[:,2] > 0
+    else:
+      frontfaces = np.greater(normals[:,2], 0,
+        out=scratch.get('frontfaces', normals.shape[:1], bool))
 
-  # Use boolean indexing to remove back-facing triangles from tri_verts,
-  # colors, and normals.
-  tri_verts = tri_verts[:, frontfaces, :]
-  colors = colors[frontfaces, :]
-  normals = normals[frontfaces, :]
+    # Use boolean indexing to remove back-facing triangles from tris,
+    # colors, and normals.  (The vertex buffer is shared, so it stays as it
+    # is.)
+    tris = _compress(frontfaces, tris, scratch, 'front_tris')
+    colors = _compress(frontfaces, colors, scratch, 'front_colors')
+    normals = _compress(frontfaces, normals, scratch, 'front_normals')
 
   # Now we have fewer triangles to render.
-  num_tris = tri_verts.shape[1]
+  num_tris = tris.shape[0]
+  stats.count('triangles_in', frontfaces.shape[0])
+  stats.count('triangles_culled', frontfaces.shape[0] - num_tris)
   # "There are", num_tris, "front-facing triangles in the scene."
 
   # Apply view-angle-based shading to the triangle colors.  Each color
@@ -129,45 +484,175 @@ def renderRaster(scene, camera, width, height):
   # (Note that you don't need to call a cosine function to compute this... think
   # about vector math, work it out symbolically, and simplify your solution.
   # The correct answer can be stated very concisely.)
-  z = np.array([[0, 0, 1]])
-  for i in range(num_tris):
-    shading = z.dot(normals[i])/np.linalg.norm(normals[i])
-    colors[i] = colors[i]*shading
-
-  # Transform all the triangle vertices into the canonical view space.
-  # Remember what that means about the resulting coordinates of vertices that
-  # fall within the camera's view frustum.
-  #   After this operation, tri_verts should be 3x(num_tris)x4, with W=1 for all
+  #   This is done by a shading function, so that other shading models can
+  # be swapped in; see incidenceShading().
+  #   With deferred shading, that waits until we know which triangle is
+  # visible at each pixel.  Until then, the "color" that each triangle
+  # paints is its own index.
+  if deferred:
+    surfaces = (colors, normals)
+    colors = np.arange(num_tris, dtype=np.int32)[:, None]
+  else:
+    with stats.stage('shade'):
+      colors = shading(colors, normals)
+      colors = fb.encodeColors(colors, None if scratch is None else
+        scratch.get('shaded_colors', colors.shape, fb.color.dtype))
+
+  # Transform all the vertices into the canonical view space.  Remember what
+  # that means about the resulting coordinates of vertices that fall within
+  # the camera's view frustum.
+  #   Before dividing by W, we clip the triangles to the view volume (see
+  # the clipping module), so that no vertex at or behind the camera gets
+  # divided.  Clipping may add vertices and split triangles.
+  #   After this operation, verts should still be 4xN, with W=1 for all
   # vertices.
-  tri = tri_verts.reshape(-1, 4).T
-  tri = camera.perspectiveNormalizationXform().dot(tri)
-  tri = tri/1.0/tri[3]
-  tri_verts = tri.T.reshape(3, -1, 4)
+  with stats.stage('project'):
+    P = camera.perspectiveNormalizationXform()
+    if scratch is None:
+      verts = P.dot(verts)
+    else:
+      verts = np.dot(P, verts, out=scratch.get('clip_verts', verts.shape))
+  with stats.stage('clip'):
+    (verts, tris, colors, source) = clipping.clipTriangles(
+      verts, tris, colors, stats=stats, scratch=scratch)
+  num_tris = tris.shape[0]
+  stats.count('triangles_rasterized', num_tris)
+  with stats.stage('project'):
+    if scratch is None:
+      verts = verts/1.0/verts[3]
+    else:
+      np.divide(verts, verts[3], out=verts)
+
+  if front_to_back:
+    with stats.stage('sort'):
+      # Nearest first, by each triangle's nearest (largest z) corner.  The
+      # sort is stable, so triangles at the same depth keep their order.
+      order = np.argsort(-np.amax(verts[2, tris], 1), kind='mergesort')
+      (tris, colors, source) = (tris[order], colors[order], source[order])
 
-  # Create the empty image (initialized to all white) and the z-buffer.
+  # The empty image (initialized to all white) and the z-buffer live in the
+  # framebuffer.
   #   Remember that the first component in these images corresponds to the X
-  # position, and the second component corresponds to Y.  So img should be
-  # (width)x(height)x3, and z_buf should be (width)x(height).
+  # position, and the second component corresponds to Y.  So img is
+  # (width)x(height)x3, and z_buf is (width)x(height).
   #   Given how z-buffering works, what should the initial value in the z-buffer
-  # be for each pixel?
-  img = np.ones((width, height, 3))
-  z_buf = np.ones((width, height)) * -1
+  # be for each pixel?  (It's -1: see Framebuffer.clear().)
+  img = fb.color
+  z_buf = fb.depth
+  if deferred:
+    img = gbuffer.triangle_ids[:, :, None]
+    z_buf = gbuffer.depth
+  if stats.enabled:
+    passed = stats.counters.get('fragments_passed', 0)
 
   # Rasterize each triangle.
-  for t in range(num_tris):
-    rasterizeTriangle(tri_verts[:, t, :], colors[t, :], img, z_buf)
+  if processes is not None:
+    with stats.stage('raster'):
+      import tile_renderer
+      tile_renderer.rasterizeTiled(verts, tris, colors, img, z_buf,
+                                   processes, tile_size, stats=stats)
+  elif occlusion:
+    # Draw the instances nearest first, skipping whatever the hierarchical
+    # z-buffer says is hidden behind what's been drawn so far.
+    with stats.stage('occlusion'):
+      boxes = _pixelBoundingBox(verts[:2, tris].transpose((2,1,0)),
+                                width, height)
+      near = np.amax(verts[2, tris], 1)
+      inst = flat.tri_inst[frontfaces][source]
+    draw = lambda sel: _rasterizeAll(engine, verts, tris[sel], colors[sel],
+                                     img, z_buf, stats, early_z)
+    depth_pyramid.drawFrontToBack(boxes, near, inst, z_buf, draw, stats)
+  else:
+    with stats.stage('raster'):
+      _rasterizeAll(engine, verts, tris, colors, img, z_buf, stats, early_z)
 
-  return img
+  if deferred:
+    with stats.stage('shade'):
+      # Shade each covered pixel with its triangle's color and normal, and
+      # turn the ids from front-facing triangle indices to scene-wide ones.
+      pix = np.nonzero(gbuffer.triangle_ids >= 0)
+      t = gbuffer.triangle_ids[pix]
+      fb.color[pix] = fb.encodeColors(shading(surfaces[0][t], surfaces[1][t]))
+      t = np.flatnonzero(frontfaces)[t]
+      gbuffer.triangle_ids[pix] = t
+      gbuffer.instance_ids[pix] = flat.instance_ids[flat.tri_inst[t]]
+      if z_buf is not fb.depth:
+        fb.depth[...] = z_buf
+    stats.count('pixels_shaded', len(t))
+
+  if stats.enabled:
+    touched = np.count_nonzero(z_buf > -1)
+    stats.count('pixels_touched', touched)
+    # Every fragment that passed the z-test, beyond the one left at each
+    # pixel, was drawn for nothing.
+    passed = stats.counters.get('fragments_passed', 0) - passed
+    stats.count('overdraw', passed - touched)
+  if stats_callback is not None:
+    stats_callback(stats)
+  result = fb.color if framebuffer is None else framebuffer
+  if picking:
+    return (result, PickBuffer(gbuffer, flat))
+  return result
+
+def _compress(mask, arr, scratch, name):
+  """Returns arr[mask], in the scratch array called name if there's a pool."""
+  if scratch is None:
+    return arr[mask]
+  out = scratch.get(name, (np.count_nonzero(mask),) + arr.shape[1:], arr.dtype)
+  return np.compress(mask, arr, 0, out=out)
+
+def _rasterizeAll(engine, verts, tris, colors, img, z_buf, stats, early_z):
+  """Rasterizes triangles, in order, with one of the serial engines."""
+  if engine == 'batch':
+    rasterizeTriangles(verts, tris, colors, img, z_buf, stats=stats,
+                       early_z=early_z)
+    return
+  if engine == 'loop':
+    rasterize = rasterizeTriangle
+  elif engine == 'vector':
+    rasterize = rasterizeTriangleVectorized
+  else:
+    raise ValueError("Unknown raster engine '%s'." % engine)
+  for t in range(tris.shape[0]):
+    color = None if colors is None else colors[t, :]
+    rasterize(verts[:, tris[t]].T, color, img, z_buf, stats, early_z)
+
+def incidenceShading(colors, normals):
+  """Shades triangles by the angle between their normals and the view.
+
+  Arguments:
+   - colors (Tx3): the surface color of each triangle.
+   - normals (Tx3): the normal vector of each triangle, in the camera-
+     centric coordinate system.  Any nonzero length is fine.
+
+  Returns a new Tx3 array: each color scaled by the cosine of the angle
+  between the triangle's normal and the Z axis (the direction back toward
+  the camera).  That cosine is just the Z component of the unit normal.
+  """
+  return colors * (normals[:, 2:3] / axisNorm(normals, 1))
+
+def flatShading(colors, normals):
+  """Returns the triangles' surface colors as they are, with no shading.
+
+  The arguments are as for incidenceShading().
+  """
+  return colors
 
-def rasterizeTriangle(verts, color, img, z_buf):
+def rasterizeTriangle(verts, color, img, z_buf, stats=render_stats.NO_STATS,
+                      early_z=False):
   """Paints a triangle onto an image with z-buffering.
 
   Arguments:
    - verts (3x4): the 4-D coordinates (in canonical view space) of the three
      vertices in this triangle.
    - color (3-element 1-D array): the perceived color of this triangle.
-   - img (WxHx3): the image to draw into.
+   - img (WxHx3): the image to draw into, or None to draw only the
+     z-buffer.
    - z_buf (WxH): the z-buffer.
+   - stats (optional): a RenderStats object to count fragments into.
+   - early_z (optional; default False): whether to skip each pixel where
+     the z-buffer is already nearer than the triangle's nearest corner,
+     without working out the triangle's depth there.
 
   The image dimensions imply a rasterization of the triangle into some number
   of fragments, each of which cooresponds to an image position (a,b).  This
@@ -221,14 +706,456 @@ def rasterizeTriangle(verts, color, img, z_buf):
   #    on the triangle (if indeed it does fall on the triangle).
   #  - Use the z-coordinate and the z-buffer to decide whether to paint the
   #    color and rewrite the z-buffer at this pixel.
+  #  The fragments are counted in locals, and handed to stats once at the
+  # end, so that counting costs next to nothing when stats is disabled.
+  if early_z:
+    near = _nearDepth(verts, z_buf.dtype)
+  (rejected, tested, passed) = (0, 0, 0)
   for a in range(min_a, max_a+1):
     for b in range(min_b, max_b+1):
+      if early_z and z_buf[a,b] > near:
+        rejected += 1
+        continue
       (x, y) = pix2view(a, b)
       p = pointOnTriangle(x, y, verts)
       if not p == None:
+        # Compare depths at the z-buffer's own precision.
+        p = z_buf.dtype.type(p)
+        tested += 1
         if p > z_buf[a,b] and p < 1:
+          passed += 1
           z_buf[a,b] = p
-          img[a,b,:] = color
+          if img is not None:
+            img[a,b,:] = color
+  if stats.enabled:
+    if early_z:
+      stats.count('early_z_rejected', rejected)
+    stats.count('fragments_tested', tested)
+    stats.count('fragments_passed', passed)
+
+def rasterizeTriangleVectorized(verts, color, img, z_buf,
+                                stats=render_stats.NO_STATS, early_z=False):
+  """Paints a triangle onto an image with z-buffering, using array math.
+
+  The arguments and the effect on img and z_buf are exactly the same as
+  for rasterizeTriangle().  The difference is that instead of visiting
+  each pixel of the triangle's bounding box in a Python loop, we compute
+  the barycentric coordinates and z-values of every pixel in the box at
+  once, and then do the z-test and the color write as masked assignments.
+  (If img is None, only the z-buffer is drawn, and the z-values come from
+  the faster _planeDepth().)
+  """
+  (W,H) = z_buf.shape
+  (min_a, max_a, min_b, max_b) = _pixelBoundingBox(verts, W, H)
+  if max_a < min_a or max_b < min_b:
+    return
+
+  # The view-space (x,y) coordinates of the centers of all the pixels in the
+  # bounding box, as (max_a-min_a+1)x(max_b-min_b+1) arrays.
+  x = (1.0/W-1) + (2.0/W) * np.arange(min_a, max_a+1, dtype=float)
+  y = (1.0/H-1) + (2.0/H) * np.arange(min_b, max_b+1, dtype=float)
+  (x, y) = np.meshgrid(x, y, indexing='ij')
+
+  # Restrict z_buf and img to the bounding box; these are views, so the
+  # masked assignments below write straight through to the full image.
+  z_box = z_buf[min_a:max_a+1, min_b:max_b+1]
+  img_box = None if img is None else img[min_a:max_a+1, min_b:max_b+1]
+  if early_z:
+    # Leave out the pixels where the z-buffer is already nearer than any
+    # part of the triangle, and work on the rest as flat arrays.
+    pix = np.nonzero(~(z_box > _nearDepth(verts, z_buf.dtype)))
+    stats.count('early_z_rejected', z_box.size - len(pix[0]))
+    if len(pix[0]) == 0:
+      return
+    (x, y) = (x[pix], y[pix])
+
+  if img is None:
+    (z, inside) = _planeDepth(x, y, verts)
+  else:
+    (z, inside) = _baryDepth(x, y, verts)
+  # Compare depths at the z-buffer's own precision.
+  z = z.astype(z_buf.dtype, copy=False)
+
+  with np.errstate(invalid='ignore'):
+    passed = inside & (z > (z_box[pix] if early_z else z_box)) & (z < 1)
+  if stats.enabled:
+    stats.count('fragments_tested', np.count_nonzero(inside))
+    stats.count('fragments_passed', np.count_nonzero(passed))
+  if early_z:
+    # Turn the mask over the flat arrays into indices into the box.
+    pix = (pix[0][passed], pix[1][passed])
+  else:
+    pix = passed
+  z_box[pix] = z[passed]
+  if img is not None:
+    img_box[pix] = color
+
+def rasterizeTriangles(verts, tris, colors, img, z_buf,
+                       max_fragments=2**17, window=None,
+                       stats=render_stats.NO_STATS, early_z=False):
+  """Paints many triangles onto an image with z-buffering, in batches.
+
+  Arguments:
+   - verts (4xN): the canonical-view coordinates of N vertices.
+   - tris (Tx3): the indices into verts of the corners of T triangles.
+   - colors (Tx3): the perceived color of each triangle.
+   - img (WxHx3): the image to draw into.  If img and colors are None,
+     only the z-buffer is drawn, with the faster _planeDepth().
+   - z_buf (WxH): the z-buffer.
+   - max_fragments (optional): a bound on the number of candidate
+     fragments processed in one batch, which bounds the temporary memory.
+   - window (optional): a tuple (a0, b0, W, H), saying that img and z_buf
+     are only the part of a WxH image whose corner pixel is (a0,b0).
+     Triangles are rasterized as they would be in the full image, but
+     only the pixels inside the window are touched.
+   - stats (optional): a RenderStats object to count fragments into.
+   - early_z (optional; default False): as for rasterizeTriangle().  Each
+     chunk's candidate pixels are tested against the z-buffer as it stood
+     before the chunk.
+
+  The result is exactly as if rasterizeTriangle() were called on each
+  triangle in order: each pixel ends up with the color of the nearest
+  fragment that lands on it, and among fragments of equal depth, the one
+  from the earliest triangle wins.  Returns a WxH array (the size of
+  z_buf) of the index of the triangle drawn at each pixel, or -1; or, if
+  only the z-buffer is drawn, None.
+
+  Rather than looping over triangles, we sort them into buckets by the
+  (power-of-two) size of their pixel bounding boxes, and cut each bucket
+  into chunks.  A chunk's fragments are generated and depth-tested as one
+  set of flat arrays, and then resolved against the z-buffer with
+  scatter-max (for depth) and scatter-min (for triangle order) operations.
+  Colors are written once at the end, so there's only ever one color write
+  per pixel.
+  """
+  (w,h) = z_buf.shape
+  if window is None:
+    window = (0, 0, w, h)
+  (a0, b0, W, H) = window
+  (min_a, max_a, min_b, max_b) = _pixelBoundingBox(
+    verts[:2, tris].transpose((2,1,0)), W, H)
+  min_a = np.maximum(min_a, a0)
+  max_a = np.minimum(max_a, a0 + w - 1)
+  min_b = np.maximum(min_b, b0)
+  max_b = np.minimum(max_b, b0 + h - 1)
+  box_w = max_a - min_a + 1
+  box_h = max_b - min_b + 1
+  live = np.flatnonzero((box_w > 0) & (box_h > 0))
+  near = None
+  if early_z:
+    near = _nearDepth(verts[:, tris].transpose((2,1,0)), z_buf.dtype)
+
+  # We work on flat, contiguous copies of the buffers only if we have to.
+  # owner[i] is the index of the triangle that currently owns pixel i, or -1
+  # if no triangle has been drawn there.  Drawing only depth, we don't need
+  # to know.
+  z = np.ascontiguousarray(z_buf).reshape(-1)
+  owner = None
+  if img is not None:
+    owner = np.empty(w*h, dtype=np.intp)
+    owner.fill(-1)
+
+  # Bucket the live triangles by the bit length of their box dimensions.
+  bucket = (_bitLength(box_w[live]) << 6) | _bitLength(box_h[live])
+  order = live[np.argsort(bucket, kind='mergesort')]
+  bucket = np.sort(bucket, kind='mergesort')
+  bounds = np.flatnonzero(np.diff(bucket)) + 1
+  for group in np.split(order, bounds):
+    if len(group) == 0:
+      continue
+    # Each chunk evaluates a (bw)x(bh) grid of pixels for each of its
+    # triangles, where the grid is big enough for every box in the bucket.
+    bw = np.amax(box_w[group])
+    bh = np.amax(box_h[group])
+    per_chunk = max(1, max_fragments // (bw*bh))
+    for c in range(0, len(group), per_chunk):
+      _rasterizeChunk(group[c:c+per_chunk], (bw, bh), verts, tris,
+                      (min_a, min_b, box_w, box_h), window, h, z, owner,
+                      near, stats)
+
+  if not np.may_share_memory(z, z_buf):
+    z_buf[...] = z.reshape(w, h)
+  if owner is None:
+    return None
+  owner = owner.reshape(w, h)
+  # One color write per painted pixel.
+  painted = owner >= 0
+  img[painted] = colors[owner[painted]]
+  return owner
+
+def _rasterizeChunk(chunk, grid, verts, tris, boxes, window, h, z, owner,
+                    near, stats):
+  """Rasterizes a chunk of triangles into the flat z and owner buffers.
+
+  This is the inner step of rasterizeTriangles(): chunk is a 1-D array of
+  triangle indices whose bounding boxes (min_a, min_b, box_w, box_h) all
+  fit in a grid of (bw)x(bh) pixels.  The window and the flat buffers'
+  column height h are as in rasterizeTriangles().  For early-z, near is the
+  _nearDepth() of every triangle; otherwise it's None.  If owner is None,
+  only z is drawn.
+  """
+  (bw, bh) = grid
+  (min_a, min_b, box_w, box_h) = boxes
+  (a0, b0, W, H) = window
+  # Candidate fragments: (triangle, da, db) triples, where (da, db) is an
+  # offset from the corner of that triangle's bounding box.
+  (t, da, db) = np.nonzero(
+    (np.arange(bw)[None,:,None] < box_w[chunk][:,None,None]) &
+    (np.arange(bh)[None,None,:] < box_h[chunk][:,None,None]))
+  t = chunk[t]
+  a = min_a[t] + da
+  b = min_b[t] + db
+  pix = (a - a0)*h + (b - b0)
+  if near is not None:
+    cand = np.flatnonzero(~(z[pix] > near[t]))
+    stats.count('early_z_rejected', len(pix) - len(cand))
+    (t, a, b, pix) = (t[cand], a[cand], b[cand], pix[cand])
+
+  x = (1.0/W-1) + (2.0/W) * a
+  y = (1.0/H-1) + (2.0/H) * b
+  depth = _baryDepth if owner is not None else _planeDepth
+  (frag_z, inside) = depth(x, y, verts[:, tris[t]].transpose((2,1,0)))
+  # Compare depths at the z-buffer's own precision.
+  frag_z = frag_z.astype(z.dtype, copy=False)
+
+  # Fragments that merely tie the z-buffer are kept, since they may come from
+  # a triangle earlier than the pixel's current owner.  Without owners, a
+  # tie can't change anything.
+  with np.errstate(invalid='ignore'):
+    if owner is None:
+      keep = np.flatnonzero(inside & (frag_z < 1) & (frag_z > z[pix]))
+    else:
+      keep = np.flatnonzero(inside & (frag_z < 1) & (frag_z >= z[pix]))
+  if stats.enabled:
+    stats.count('fragments_tested', np.count_nonzero(inside))
+    stats.count('fragments_passed',
+                np.count_nonzero(frag_z[keep] > z[pix[keep]]))
+  if len(keep) == 0:
+    return
+  (t, pix, frag_z) = (t[keep], pix[keep], frag_z[keep])
+  if owner is None:
+    np.maximum.at(z, pix, frag_z)
+    return
+
+  # Resolve depth with a scatter-max.  Pixels whose depth went up get a new
+  # owner: the earliest triangle among the fragments at that new depth.
+  # Pixels whose depth didn't change can still be claimed by an earlier
+  # triangle with an equal depth, as long as some triangle was drawn there.
+  old_z = z[pix]
+  np.maximum.at(z, pix, frag_z)
+  new_z = z[pix]
+  raised = pix[new_z > old_z]
+  owner[raised] = np.iinfo(owner.dtype).max
+  best = frag_z == new_z
+  np.minimum.at(owner, pix[best], t[best])
+
+def rasterizeLines(verts, edges, colors, img, max_fragments=2**17):
+  """Paints many line segments onto an image, in batches.
+
+  Arguments:
+   - verts (4xN): the canonical-view coordinates of N vertices.
+   - edges (Ex2): the indices into verts of the endpoints of E segments.
+   - colors (Ex3): the color of each segment.
+   - img (WxHx3): the image to draw into.
+   - max_fragments (optional): a bound on the number of pixels processed
+     in one batch, which bounds the temporary memory.
+
+  Each segment is clipped to the image, and then drawn as a DDA line: one
+  pixel per step along its longer image axis, at the rounded position of
+  each step.  Where segments overlap, the later one wins.  Returns a WxH
+  array of the index of the segment drawn at each pixel, or -1.
+  """
+  (W,H) = img.shape[:2]
+  # Continuous pixel coordinates, where pixel (a,b) is centered on (a,b).
+  # This matches the pixel mapping in rasterizeTriangle().
+  u = (verts[0, edges] + 1) * (W/2.0) - 0.5
+  v = (verts[1, edges] + 1) * (H/2.0) - 0.5
+  (u, v, live) = _clipSegments(u, v, W, H)
+  live = np.flatnonzero(live)
+
+  # Each live segment takes one step per pixel along its longer axis.
+  with np.errstate(invalid='ignore'):
+    steps = np.ceil(np.maximum(np.abs(u[live,1] - u[live,0]),
+                               np.abs(v[live,1] - v[live,0]))).astype(int)
+  steps = np.maximum(steps, 1)
+
+  owner = np.empty(W*H, dtype=np.intp)
+  owner.fill(-1)
+  # Cut the segments into chunks of about max_fragments pixels each.
+  ends = np.cumsum(steps + 1)
+  total = ends[-1] if len(ends) > 0 else 0
+  cuts = np.searchsorted(ends, np.arange(max_fragments, total, max_fragments))
+  for chunk in np.split(np.arange(len(live)), cuts):
+    if len(chunk) == 0:
+      continue
+    (e, n) = (live[chunk], steps[chunk])
+    # One (segment, step) pair per pixel: k counts up from 0 to n in each.
+    seg = np.repeat(np.arange(len(chunk)), n + 1)
+    k = np.arange(len(seg)) - np.repeat(np.cumsum(n + 1) - (n + 1), n + 1)
+    t = k / n[seg].astype(float)
+    a = np.floor(0.5 + u[e,0][seg] + t*(u[e,1] - u[e,0])[seg]).astype(int)
+    b = np.floor(0.5 + v[e,0][seg] + t*(v[e,1] - v[e,0])[seg]).astype(int)
+    ok = (a >= 0) & (a < W) & (b >= 0) & (b < H)
+    np.maximum.at(owner, a[ok]*H + b[ok], e[seg[ok]])
+
+  owner = owner.reshape(W, H)
+  painted = owner >= 0
+  img[painted] = colors[owner[painted]]
+  return owner
+
+def _clipSegments(u, v, W, H):
+  """Clips line segments to the pixel rectangle of a WxH image.
+
+  Arguments u and v are Ex2 arrays of the continuous pixel coordinates of
+  the endpoints of E segments.  Uses the Liang-Barsky algorithm on all the
+  segments at once.  Returns (u, v, live): the clipped endpoints, and a
+  boolean array that is False for the segments entirely outside the image
+  (or with non-finite endpoints), whose endpoints are then meaningless.
+  """
+  du = u[:,1] - u[:,0]
+  dv = v[:,1] - v[:,0]
+  t0 = np.zeros(len(u))
+  t1 = np.ones(len(u))
+  live = np.isfinite(du) & np.isfinite(dv)
+  with np.errstate(invalid='ignore', divide='ignore'):
+    for (p, q) in ((-du, u[:,0] + 0.5), (du, W - 0.5 - u[:,0]),
+                   (-dv, v[:,0] + 0.5), (dv, H - 0.5 - v[:,0])):
+      live &= (p != 0) | (q >= 0)
+      r = q / p
+      t0 = np.where(p < 0, np.maximum(t0, r), t0)
+      t1 = np.where(p > 0, np.minimum(t1, r), t1)
+    live &= t0 <= t1
+  u = np.stack((u[:,0] + t0*du, u[:,0] + t1*du), 1)
+  v = np.stack((v[:,0] + t0*dv, v[:,0] + t1*dv), 1)
+  return (u, v, live)
+
+def _bitLength(n):
+  """Returns the number of bits needed to represent each positive int in n.
+  """
+  return np.floor(np.log2(np.maximum(n, 1))).astype(int) + 1
+
+def _pixelBoundingBox(verts, W, H):
+  """Returns the clipped pixel bounding box of one or more triangles.
+
+  Arguments:
+   - verts (3x4 or 3xTx4): the canonical-view coordinates of a triangle
+     (or of T triangles).  Only the X and Y coordinates are used, so the
+     last dimension may also be 2.
+   - W, H: the image dimensions, in pixels.
+
+  Returns (min_a, max_a, min_b, max_b), the inclusive range of pixel
+  indices covered by the triangle's bounding box, computed exactly as in
+  rasterizeTriangle().  Each is an int, or a length-T array of ints.  A box
+  is empty if max_a < min_a or max_b < min_b.
+  """
+  o_x = 1.0/W-1
+  s_x = 2.0/W
+  o_y = 1.0/H-1
+  s_y = 2.0/H
+  # np.where() rather than np.maximum()/np.minimum(), to match what the
+  # builtin max() and min() do with NaNs.
+  with np.errstate(invalid='ignore'):
+    lo = np.amin(verts[..., :2], axis=0)
+    hi = np.amax(verts[..., :2], axis=0)
+    lo = np.where(lo > -1, lo, -1)
+    hi = np.where(hi < 1 - 1.0/np.array([W, H]), hi, 1 - 1.0/np.array([W, H]))
+  min_a = (0.5 + (lo[..., 0] - o_x)/s_x).astype(int)
+  max_a = (0.5 + (hi[..., 0] - o_x)/s_x).astype(int)
+  min_b = (0.5 + (lo[..., 1] - o_y)/s_y).astype(int)
+  max_b = (0.5 + (hi[..., 1] - o_y)/s_y).astype(int)
+  return (min_a, max_a, min_b, max_b)
+
+def _nearDepth(verts, dtype):
+  """Returns the depth bound that early-z tests a triangle against.
+
+  Arguments:
+   - verts (3x4, or 3xTx4): the canonical-view coordinates of a triangle
+     (or of T triangles).
+   - dtype: the z-buffer's element type.
+
+  Returns the nearest (largest) z of the corners, plus a hair of slack for
+  rounding in the depth interpolation, rounded to dtype just as fragment
+  depths are.  No fragment of the triangle can pass the z-test at a pixel
+  whose z-buffer value is greater than this.
+  """
+  return (np.amax(verts[..., 2], 0) + depth_pyramid.DEPTH_SLACK).astype(dtype)
+
+def _baryDepth(x, y, verts):
+  """Evaluates pointOnTriangle() over arrays of (x,y) positions.
+
+  Arguments:
+   - x, y: same-shape arrays of canonical-view coordinates.
+   - verts (3x4, or 3x...x4): the canonical-view coordinates of a
+     triangle.  The middle dimensions, if any, must broadcast against x,
+     which lets every point have its own triangle.
+
+  Returns (z, inside), two arrays shaped like x.  Where inside is True,
+  the point lies on the triangle and z is its interpolated z-coordinate;
+  elsewhere z is meaningless.  The arithmetic follows pointOnTriangle()
+  term for term (including np.linalg.det() on stacks of the same 3x3 and
+  2x2 matrices), so the results match it bit for bit.
+  """
+  (x1, x2, x3) = verts[..., 0]
+  (y1, y2, y3) = verts[..., 1]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    num = np.empty(x.shape + (3, 3))
+    num[..., 0, 0] = x
+    num[..., 1, 0] = y
+    num[..., 0, 1] = x2
+    num[..., 0, 2] = x3
+    num[..., 1, 1] = y2
+    num[..., 1, 2] = y3
+    num[..., 2, :] = 1
+    den = np.empty(x.shape + (2, 2))
+    den[..., 0, 0] = x - x3
+    den[..., 1, 0] = y - y3
+    den[..., 0, 1] = x1 - x2
+    den[..., 1, 1] = y1 - y2
+    a = -np.linalg.det(num) / np.linalg.det(den)
+    b = (x - x3)/(a*(x1 - x2) + (x2 - x3))
+    inside = ~((b*a < 0) | (b*(1-a) < 0) | (1-b < 0))
+    z = b*(a*verts[0, ..., 2] + (1-a)*verts[1, ..., 2]) + (1-b)*verts[2, ..., 2]
+  return (z, inside)
+
+def _planeDepth(x, y, verts):
+  """A faster _baryDepth(), for when only the depth will be drawn.
+
+  The arguments and return value are as for _baryDepth().  Instead of
+  solving for barycentric coordinates with determinants at every point,
+  this evaluates the triangle's three edge functions, which are just a few
+  multiplies each.  Some points are handed to _baryDepth(): those that
+  come within EDGE_TOLERANCE of an edge (relative to the size of the
+  terms), where rounding could make the two methods disagree, every point
+  of a degenerate triangle, and points with the same x as corner 3.  So
+  inside is exactly what _baryDepth() would return.  z may differ from
+  its z in the last few bits (around 1e-12), which a float32 z-buffer
+  hides.
+  """
+  (x1, x2, x3) = verts[..., 0]
+  (y1, y2, y3) = verts[..., 1]
+  (z1, z2, z3) = verts[..., 2]
+  with np.errstate(divide='ignore', invalid='ignore'):
+    # Twice the signed area of the triangle, and of the triangle that the
+    # point makes with each edge, opposite corner 1, 2, and 3.
+    terms = [((x2 - x1)*(y3 - y1), (x3 - x1)*(y2 - y1)),
+             ((x2 - x)*(y3 - y), (x3 - x)*(y2 - y)),
+             ((x3 - x)*(y1 - y), (x1 - x)*(y3 - y)),
+             ((x1 - x)*(y2 - y), (x2 - x)*(y1 - y))]
+    (area, e1, e2, e3) = [p - q for (p, q) in terms]
+    z = (e1*z1 + e2*z2 + e3*z3) / area
+    inside = ((e1*area >= 0) & (e2*area >= 0) & (e3*area >= 0))
+    close = np.zeros(np.broadcast(x, area).shape, dtype=bool)
+    for (e, (p, q)) in zip((area, e1, e2, e3), terms):
+      close |= ~(np.abs(e) > EDGE_TOLERANCE * (np.abs(p) + np.abs(q)))
+    # pointOnTriangle() finds b = 0, and so takes the point to be on the
+    # triangle at corner 3's depth, anywhere straight above or below corner
+    # 3.  Leave those to it too, so the depth matches the color pass there.
+    close |= (x == x3)
+  if np.any(close):
+    if verts.ndim > 2:
+      verts = verts[:, close]
+    (z[close], inside[close]) = _baryDepth(x[close], y[close], verts)
+  return (z, inside)
 
 def pointOnTriangle(x, y, verts):
   """Returns the z-coordinate of a point on a triangle, given x and y.
@@ -316,6 +1243,58 @@ def allTriData(instances, world_to_camera):
 
   return (tri_verts, colors, normals)
 
+def indexedTriData(flat, world_to_camera, scratch=None):
+  """Returns a shared vertex array, triangles, colors, and normals.
+
+  This is allTriData() for a FlatScene, without copying every triangle's
+  corners.  Arguments:
+   - flat: a FlatScene.
+   - world_to_camera (4x4): as for allTriData().
+   - scratch (optional): a renderer.ScratchPool to put verts, colors,
+     normals, and the temporaries used to compute them in, instead of new
+     arrays.
+
+  Returns (verts, tris, colors, normals).  To define these, say N is the
+  total number of vertices and T the total number of triangles used by
+  all instances.
+   - verts (4xN): the camera-centric homogeneous coordinates of every
+     instance's vertices.
+   - tris (Tx3): tris[t, i] is the index into verts of vertex i of
+     triangle t.  The triangles are in the same order as allTriData()'s.
+   - colors (Tx3), normals (Tx3): exactly as for allTriData().
+  """
+  tris = flat.inst_tris
+  if scratch is None:
+    verts = flat.transformVerts(world_to_camera)
+    colors = flat.colors[flat.tri_inst]
+  else:
+    verts = flat.transformVerts(world_to_camera,
+      out=scratch.get('cam_verts', (4, flat.numVerts())))
+    colors = np.take(flat.colors, flat.tri_inst, 0,
+                     out=scratch.get('tri_colors', (len(tris), 3)))
+  # Same arithmetic as triangleNormals(), one coordinate row at a time.
+  X = verts[:3]
+  if scratch is None:
+    normals = np.cross((X[:, tris[:,1]] - X[:, tris[:,0]]).T,
+                       (X[:, tris[:,2]] - X[:, tris[:,0]]).T)
+    return (verts, tris, colors, normals)
+
+  # The same again, but with every temporary in the scratch pool.  The
+  # cross product is spelled out term by term as np.cross() computes it.
+  T = len(tris)
+  (e1, e2, e0) = [scratch.get(name, (3, T))
+                  for name in ('edge1', 'edge2', 'edge0')]
+  np.take(X, tris[:,0], 1, out=e0)
+  np.subtract(np.take(X, tris[:,1], 1, out=e1), e0, out=e1)
+  np.subtract(np.take(X, tris[:,2], 1, out=e2), e0, out=e2)
+  normals = scratch.get('normals', (T, 3))
+  term = e0[0]  # e0 isn't needed any more.
+  for (i, j, k) in ((0, 1, 2), (1, 2, 0), (2, 0, 1)):
+    np.multiply(e1[j], e2[k], out=normals[:, i])
+    np.multiply(e1[k], e2[j], out=term)
+    np.subtract(normals[:, i], term, out=normals[:, i])
+  return (verts, tris, colors, normals)
+
 def triangleNormals(X):
   """Returns the normal vectors of a set of triangles in space.
 
@@ -0,0 +1,164 @@
+"""
+render_stats --- Per-stage timings and counters for the render pipeline.
+
+Pass a RenderStats object as the stats option of renderRaster() (or
+plotLines(), etc.) and it will be filled in with the wall time spent in each
+stage of the pipeline and with counts of what went through it:
+
+  stats = RenderStats()
+  img = renderRaster(scene, camera, 300, 200, stats=stats)
+  print stats
+
+Or pass any function instead, and it will be called with a filled-in
+RenderStats at the end of the render:
+
+  img = renderRaster(scene, camera, 300, 200, stats=log_function)
+
+The stages are named by the renderer ('traverse', 'transform', 'cull',
+'shade', 'project', 'clip', 'sort', 'occlusion', 'raster', ...), and so
+are the counters:
+ - instances_in: instances in the scenegraph.
+ - instances_culled: instances skipped for being outside the view frustum.
+ - triangles_in: triangles in the scene.
+ - triangles_culled: triangles removed by backface culling.
+ - triangles_rejected: front-facing triangles dropped for being entirely
+   outside the view volume.
+ - triangles_clipped: front-facing triangles clipped to the near or far
+   plane or the guard band (see the clipping module).
+ - triangles_rasterized: triangles sent to the rasterizer, after clipping.
+ - instances_occluded, triangles_occluded: with the occlusion option,
+   instances and triangles skipped for being hidden behind what was
+   already drawn.  (triangles_occluded includes the occluded instances'.)
+ - edges_rejected: with renderWireframe(), lines dropped for being entirely
+   nearer than the near plane.
+ - edges_clipped: with renderWireframe(), lines cut short at the near plane.
+ - edges_rasterized: lines sent to the line rasterizer (renderWireframe()),
+   after clipping.
+ - fragments_tested: fragments (triangle/pixel pairs) that landed on a
+   triangle and were tested against the z-buffer.
+ - fragments_passed: fragments that passed the z-test.  (The batch engine
+   tests each chunk of fragments against the z-buffer as it stood before
+   that chunk, so its count can differ slightly from the other engines'.)
+ - early_z_rejected: with the early_z option, pixels of triangles'
+   bounding boxes skipped because the z-buffer was already nearer than the
+   whole triangle.
+ - pixels_touched: pixels of the image that were drawn at all.
+ - pixels_shaded: with the deferred option, pixels shaded after
+   rasterizing.
+ - overdraw: fragments that passed the z-test only to be drawn over by a
+   nearer one later (fragments_passed minus pixels_touched).
+
+When no stats are requested, the renderer uses NO_STATS, whose methods do
+nothing, and skips any work done only to compute counters.
+"""
+from timeit import default_timer as timer
+
+class RenderStats(object):
+  """Timings and counters collected during one or more renders.
+
+  Public attributes:
+   - times: a dict mapping each stage name to the total wall time, in
+     seconds, spent in that stage.
+   - counters: a dict mapping each counter name to its total.
+   - enabled: always True (see NO_STATS).
+  """
+  enabled = True
+
+  def __init__(self):
+    self.times = {}
+    self.counters = {}
+    self._order = []
+
+  def stage(self, name):
+    """Returns a context manager that times a stage of the pipeline.
+
+    Use it in a with statement; the time spent in the block is added to
+    times[name].  Entering the same stage again adds to its total.
+    """
+    return _StageTimer(self, name)
+
+  def count(self, name, n):
+    """Adds n to the counter called name."""
+    self.counters[name] = self.counters.get(name, 0) + int(n)
+
+  def merge(self, other):
+    """Adds the times and counters of another RenderStats into this one."""
+    for name in other._order:
+      self._addTime(name, other.times[name])
+    for (name, n) in other.counters.items():
+      self.count(name, n)
+
+  def total(self):
+    """Returns the total time over all stages, in seconds."""
+    return sum(self.times.values())
+
+  def asDict(self):
+    """Returns the times and counters as a plain dict (e.g. for JSON)."""
+    return {'times': dict(self.times), 'counters': dict(self.counters)}
+
+  def _addTime(self, name, seconds):
+    if name not in self.times:
+      self._order.append(name)
+      self.times[name] = 0.0
+    self.times[name] += seconds
+
+  def __str__(self):
+    lines = ["%-12s %9.3f ms" % (name, 1000*self.times[name])
+             for name in self._order]
+    lines += ["%-22s %d" % (name, self.counters[name])
+              for name in sorted(self.counters)]
+    return "\n".join(lines)
+
+
+class _StageTimer(object):
+  def __init__(self, stats, name):
+    self._stats = stats
+    self._name = name
+
+  def __enter__(self):
+    self._start = timer()
+    return self
+
+  def __exit__(self, *exc_info):
+    self._stats._addTime(self._name, timer() - self._start)
+    return False
+
+
+class _NullStats(object):
+  """A stand-in for RenderStats that records nothing."""
+  enabled = False
+
+  def stage(self, name):
+    return _NULL_STAGE
+
+  def count(self, name, n):
+    pass
+
+  def merge(self, other):
+    pass
+
+
+class _NullStage(object):
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *exc_info):
+    return False
+
+_NULL_STAGE = _NullStage()
+
+NO_STATS = _NullStats()
+
+def resolve(stats):
+  """Interprets the stats option of a render call.
+
+  Argument stats may be None, a RenderStats, or a function.  Returns a
+  pair (recorder, callback): the object the renderer should record into
+  (NO_STATS if stats is None), and a function to call with it when the
+  render is done (or None).
+  """
+  if stats is None:
+    return (NO_STATS, None)
+  if callable(stats) and not hasattr(stats, 'stage'):
+    return (RenderStats(), stats)
+  return (stats, None)
@@ -0,0 +1,138 @@
+"""
+renderer --- A raster renderer that reuses its memory from frame to frame.
+
+renderRaster() allocates everything it needs on every call: the image, the
+z-buffer, and a handful of arrays the size of the whole scene.  That's fine
+for one picture, but in a preview loop running at 24 frames per second the
+churn shows up as allocator and page-fault time.  A Renderer wraps the same
+pipeline, but owns its framebuffer, the FlatScene it renders from, and a
+pool of scratch arrays.  Between frames, the framebuffer is cleared in
+place, the FlatScene is refreshed with the scene's new transforms and
+colors (see FlatScene.refresh()), and the transformed vertices, the
+per-triangle colors, normals, and front-facing subsets, the shaded colors,
+and the clipping temporaries go into the same arrays as before.  Those
+are only reallocated when the resolution or the scene outgrows them.
+
+What's still allocated every frame: whatever the shading function returns
+(before it's copied into the pool), the pieces of any triangles that have
+to be clipped, and the rasterizers' own working arrays.  And if the
+scene's instances change, not just their poses, its FlatScene is rebuilt.
+
+  r = Renderer(engine='batch')
+  for i in range(num_frames):
+    pose(scene, i)
+    fb = r.render(scene, camera, 640, 480)
+    show(fb.toUint8())
+
+The Framebuffer returned by render() belongs to the Renderer, and is
+overwritten by the next call; copy out anything you want to keep.
+"""
+import numpy as np
+from framebuffer import Framebuffer
+import flat_scene
+import projection_renderer
+
+class Renderer(object):
+  """A raster renderer that keeps its buffers between frames.
+
+  Public attributes:
+   - options: a dict of the default renderRaster() options (engine,
+     shading, etc.) for every frame.
+   - scratch: the ScratchPool of temporary arrays.
+  """
+
+  def __init__(self, color_dtype=np.float64, depth_dtype=np.float64,
+               **options):
+    """Creates a Renderer.
+
+    Arguments:
+     - color_dtype, depth_dtype (optional; default float64): the element
+       types of the framebuffer (see framebuffer.Framebuffer).  The
+       defaults give exactly the image that renderRaster() returns.
+    Any other keyword arguments are default options for renderRaster().
+    """
+    self.options = options
+    self.scratch = ScratchPool()
+    self._dtypes = (color_dtype, depth_dtype)
+    self._fb = None
+    self._scene = None
+    self._flat = None
+
+  def render(self, scene, camera, width, height, **options):
+    """Renders a frame, and returns the Renderer's Framebuffer.
+
+    The arguments are as for projection_renderer.renderRaster(); any
+    options given here override the Renderer's defaults for this frame.
+    A scenegraph is rendered from flatScene(scene), so every instance is
+    drawn, and the cull option doesn't apply.  (Clipping still drops the
+    triangles outside the view.)
+    """
+    options = dict(self.options, **options)
+    options.pop('cull', None)
+    return projection_renderer.renderRaster(
+      self.flatScene(scene), camera, width, height,
+      framebuffer=self.framebuffer(width, height), scratch=self.scratch,
+      **options)
+
+  def flatScene(self, scene):
+    """Returns the Renderer's FlatScene for a scenegraph, brought up to date.
+
+    The FlatScene is kept from one call to the next.  If scene is the same
+    RootNode as last time, it's refreshed (see FlatScene.refresh()), which
+    only rebuilds it if the instances have changed; otherwise a new one is
+    flattened.  A FlatScene is returned as it is.
+    """
+    if isinstance(scene, flat_scene.FlatScene):
+      return scene
+    if scene is self._scene:
+      self._flat.refresh(scene)
+    else:
+      self._flat = flat_scene.flattenScene(scene)
+      self._scene = scene
+    return self._flat
+
+  def framebuffer(self, width, height):
+    """Returns the Renderer's Framebuffer, sized (width)x(height).
+
+    The buffers are only reallocated when they have to grow; a smaller
+    frame reuses the start of the old ones.
+    """
+    fb = self._fb
+    if fb is not None and (fb.width, fb.height) == (width, height):
+      return fb
+    (color_dtype, depth_dtype) = self._dtypes
+    storage = (self.scratch.get('color', (width*height*3,), color_dtype),
+               self.scratch.get('depth', (width*height,), depth_dtype))
+    self._fb = Framebuffer(width, height, color_dtype, depth_dtype,
+                           storage=storage)
+    return self._fb
+
+
+class ScratchPool(object):
+  """A set of named, reusable temporary arrays.
+
+  get() hands out an array of any shape for each name, always backed by the
+  same memory, which is only reallocated when a request outgrows it.  The
+  contents are left over from the array's last use.
+  """
+
+  def __init__(self):
+    self._buffers = {}
+
+  def get(self, name, shape, dtype=float):
+    """Returns an uninitialized array for name, with this shape and dtype.
+
+    The array is a contiguous view of the name's buffer, so any array
+    previously returned for the same name shares its memory.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape))
+    buf = self._buffers.get(name)
+    if buf is None or buf.dtype != dtype or buf.size < size:
+      buf = np.empty(size, dtype=dtype)
+      self._buffers[name] = buf
+    return buf[:size].reshape(shape)
+
+  def nbytes(self):
+    """Returns the memory held by the pool, in bytes."""
+    return sum(buf.nbytes for buf in self._buffers.values())
@@ -1,9 +1,11 @@
 import numpy as np
 import scenegraph as sg
 import meshes
-from gfx_helper_mayavi import *
 
 def main():
+  # Mayavi is slow to load and needs a GUI, so only load it to plot.
+  from gfx_helper_mayavi import setUpFigure, drawTriMesh, showFigure
+
   # First, a bunch of simple arm poses, for the screenshots in the
   # assignment...
   #no_angles = np.array([0, 0, 0])
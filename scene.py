@@ -10,13 +10,15 @@ import numpy as np
 import scenegraph as sg
 import meshes
 import our_shapes as os
-#from gfx_helper_script import *
-import gfx_helper_script as helper
+from mesh_cache import cachedMesh
 from camera import Camera
 import projection_renderer as render
 from gfx_helper_plotting import *
 
 def main():
+  # The plotting helper needs a GUI backend, so we only load it when we're
+  # actually going to show something.
+  import gfx_helper_script as helper
 
   # Create a scenegraph with desired values.
   scene = makeScene(1, 5, 5, 2,
@@ -91,7 +93,9 @@ def makeScene(diameter, upper_arm, forearm, hand, shoulder, elbow, wrist,
                           rotates both trees at the roots, and trunkBend
                           rotates both trees at the top of their trunks.
 
-  Returns the root node of the scenegraph for this combination scene.
+  Returns the root node of the scenegraph for this combination scene.  The
+  meshes come from mesh_cache, so building the scene again (e.g. for every
+  frame of an animation) reuses them instead of generating them anew.
   """
   # Root node.
   r = sg.RootNode()
@@ -167,7 +171,7 @@ def makeScene(diameter, upper_arm, forearm, hand, shoulder, elbow, wrist,
   su_floor.addChild(scale)
 
   # Add cube shape node.
-  c = sg.ShapeNode(meshes.cube(), "cube")
+  c = sg.ShapeNode(cachedMesh(meshes.cube), "cube")
   scale.addChild(c)
 
   # My scene.
@@ -187,9 +191,7 @@ def makeScene(diameter, upper_arm, forearm, hand, shoulder, elbow, wrist,
   s2.addChild(t2)
   su_ball = sg.SurfaceNode(np.array([91, 199, 252])/256.0, "squished ball surf")
   t2.addChild(su_ball)
-  s = os.squishedBall(7)
-  s = (os.vertsToHomogeneous(s[0]), s[1])
-  squishedBall = sg.ShapeNode(s, "squished ball")
+  squishedBall = sg.ShapeNode(cachedMesh(os.squishedBall, 7), "squished ball")
   su_ball.addChild(squishedBall)
 
   # Two trees.
@@ -228,9 +230,7 @@ def makeScene(diameter, upper_arm, forearm, hand, shoulder, elbow, wrist,
   s4.addChild(t7)
   su_cones = sg.SurfaceNode(np.array([41, 255, 66])/256.0, "doubleCones surf")
   t7.addChild(su_cones)
-  d = os.doubleCone(12)
-  d = (os.vertsToHomogeneous(d[0]), d[1])
-  doubleCone = sg.ShapeNode(d, "double cone")
+  doubleCone = sg.ShapeNode(cachedMesh(os.doubleCone, 12), "double cone")
   su_cones.addChild(doubleCone)
 
   # Two cylinders.
@@ -241,7 +241,7 @@ def makeScene(diameter, upper_arm, forearm, hand, shoulder, elbow, wrist,
   t6.addChild(t8)
   su_cyls = sg.SurfaceNode(np.array([107, 71, 4])/256.0, "cylinders surface")
   t8.addChild(su_cyls)
-  cylinder = sg.ShapeNode(meshes.prism(12), "cylinder")
+  cylinder = sg.ShapeNode(cachedMesh(meshes.prism, 12), "cylinder")
   su_cyls.addChild(cylinder)
 
   return r
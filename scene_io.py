@@ -0,0 +1,189 @@
+"""
+scene_io --- Saving scenegraphs to a binary file, and loading them back.
+
+Building a scene means running the Python code that builds it, meshes and
+all, in every process that wants it.  saveScene() writes a finished
+scenegraph to one file instead, and loadScene() rebuilds it from there:
+
+  scene_io.saveScene(scene.makeScene(...), 'arm.scene')
+  ...
+  root = scene_io.loadScene('arm.scene')
+
+The whole DAG is kept, with each shared node (and each shared mesh) stored
+once and shared again after loading, along with every node's name,
+transform, and parameters, and every surface color.  The mesh arrays are
+memory-mapped straight out of the file, read-only, so loading is quick no
+matter how big the meshes are, and every process that loads the same file
+shares one copy of them in the page cache.  (That only works if each
+process loads the file itself: pickling a loaded mesh, e.g. to send it to a
+multiprocessing worker, copies it.)
+
+The file is a 16-byte preamble (the magic string "SCENEBIN", the format
+version, and the header's length), a JSON header describing the nodes and
+where each array is, and then the arrays' raw data, each one aligned to
+ALIGNMENT bytes.
+"""
+import json
+import struct
+import numpy as np
+import scenegraph as sg
+
+MAGIC = b'SCENEBIN'
+VERSION = 1
+# The byte alignment of each array in the file.
+ALIGNMENT = 64
+
+def saveScene(root, path):
+  """Writes a scenegraph to a file.
+
+  Arguments:
+   - root: the scenegraph's RootNode.
+   - path: the file name.
+
+  The nodes must all be of the types in the scenegraph module.
+  """
+  nodes = []
+  index = {}
+  blobs = []
+  mesh_index = {}
+
+  def addBlob(arr):
+    arr = np.ascontiguousarray(arr)
+    offset = 0
+    if blobs:
+      (last, last_offset) = blobs[-1]
+      offset = _align(last_offset + last.nbytes)
+    blobs.append((arr, offset))
+    return {'dtype': arr.dtype.str, 'shape': list(arr.shape),
+            'offset': offset}
+
+  def visit(node):
+    if id(node) in index:
+      return index[id(node)]
+    record = _describe(node)
+    index[id(node)] = len(nodes)
+    nodes.append(record)
+    if isinstance(node, sg.ShapeNode) and node.mesh is not None:
+      (verts, tris) = node.mesh
+      key = (id(verts), id(tris))
+      if key not in mesh_index:
+        mesh_index[key] = {'verts': addBlob(verts), 'tris': addBlob(tris)}
+      record['mesh'] = mesh_index[key]
+    record['children'] = [visit(c) for c in node._children]
+    return index[id(node)]
+
+  visit(root)
+  header = json.dumps({'nodes': nodes}, sort_keys=True).encode('ascii')
+  data_start = _align(16 + len(header))
+  with open(path, 'wb') as f:
+    f.write(MAGIC + struct.pack('<II', VERSION, len(header)))
+    f.write(header)
+    for (arr, offset) in blobs:
+      f.write(b'\0' * (data_start + offset - f.tell()))
+      f.write(arr.tobytes())
+
+def loadScene(path, mmap=True):
+  """Reads a scenegraph from a file written by saveScene().
+
+  Arguments:
+   - path: the file name.
+   - mmap (optional; default True): whether to memory-map the mesh arrays.
+     If False, they're read into memory instead.
+
+  Returns the scenegraph's RootNode.  Either way, the mesh arrays are read-
+  only.
+  """
+  with open(path, 'rb') as f:
+    preamble = f.read(16)
+    if len(preamble) < 16 or preamble[:8] != MAGIC:
+      raise ValueError("'%s' isn't a scene file." % path)
+    (version, header_len) = struct.unpack('<II', preamble[8:])
+    if version != VERSION:
+      raise ValueError("'%s' has scene format version %d, not %d." %
+                       (path, version, VERSION))
+    header = json.loads(f.read(header_len).decode('ascii'))
+    data_start = _align(16 + header_len)
+    if mmap:
+      data = np.memmap(f, dtype=np.uint8, mode='r')
+    else:
+      f.seek(0)
+      data = np.frombuffer(f.read(), dtype=np.uint8)
+
+  def blob(desc):
+    dtype = np.dtype(str(desc['dtype']))
+    start = data_start + desc['offset']
+    size = int(np.prod(desc['shape'])) * dtype.itemsize
+    return data[start:start + size].view(dtype).reshape(desc['shape'])
+
+  # Build every node, and then link them up, so that shared nodes (which
+  # may be reached before or after their parents' other children) are only
+  # built once.
+  meshes = {}
+  nodes = []
+  for record in header['nodes']:
+    mesh = None
+    if 'mesh' in record:
+      key = (record['mesh']['verts']['offset'],
+             record['mesh']['tris']['offset'])
+      if key not in meshes:
+        meshes[key] = (blob(record['mesh']['verts']),
+                       blob(record['mesh']['tris']))
+      mesh = meshes[key]
+    nodes.append(_build(record, mesh))
+  for (node, record) in zip(nodes, header['nodes']):
+    for c in record['children']:
+      node.addChild(nodes[c])
+  return nodes[0]
+
+def _describe(node):
+  """Returns a JSON-friendly dict of a node's type, name, and parameters."""
+  kind = type(node).__name__
+  record = {'type': kind, 'name': getattr(node, '_label', node.name)}
+  if kind == 'TranslateNode':
+    record['vec'] = np.asarray(node.vec).tolist()
+  elif kind == 'RotateNode':
+    record['angles'] = np.asarray(node.angles).tolist()
+  elif kind == 'ScaleNode':
+    record['factors'] = np.asarray(node.factors).tolist()
+  elif kind == 'ShearNode':
+    record['shear'] = [node.shear_dim, node.contrib_dim, node.factor]
+  elif kind == 'SurfaceNode':
+    record['color'] = np.asarray(node.color).tolist()
+  elif kind not in ('RootNode', 'GroupNode', 'ShapeNode', 'XformNode'):
+    raise TypeError("Can't save a %s." % kind)
+  if isinstance(node, sg.XformNode):
+    # The matrix is saved too, in case it was set directly with setXform().
+    record['xform'] = np.asarray(node._xform, dtype=float).tolist()
+  return record
+
+def _build(record, mesh):
+  """Returns a new node, without children, from a _describe() record."""
+  kind = record['type']
+  name = record['name']
+  if kind == 'RootNode':
+    node = sg.RootNode()
+  elif kind == 'GroupNode':
+    node = sg.GroupNode(name)
+  elif kind == 'ShapeNode':
+    node = sg.ShapeNode(mesh, name)
+  elif kind == 'SurfaceNode':
+    node = sg.SurfaceNode(np.array(record['color']), name)
+  elif kind == 'TranslateNode':
+    node = sg.TranslateNode(np.array(record['vec']), name)
+  elif kind == 'RotateNode':
+    node = sg.RotateNode(np.array(record['angles']), name)
+  elif kind == 'ScaleNode':
+    node = sg.ScaleNode(np.array(record['factors']), name)
+  elif kind == 'ShearNode':
+    (shear_dim, contrib_dim, factor) = record['shear']
+    node = sg.ShearNode(shear_dim, contrib_dim, factor, name)
+  elif kind == 'XformNode':
+    node = sg.XformNode(None, name)
+  else:
+    raise ValueError("Unknown node type '%s'." % kind)
+  if 'xform' in record:
+    node._xform = np.array(record['xform'])
+  return node
+
+def _align(n):
+  return -(-n // ALIGNMENT) * ALIGNMENT
@@ -49,6 +49,17 @@ the leaves.
 in the scene.  In each tuple, the first element is a 4x4 numpy array for the
 composite transform of a shape.  The second element is a reference to the
 ShapeNode object to which that transform should be applied.
+  The composite transforms are cached in the nodes of the scenegraph.  A
+shared subtree is only computed once, no matter how many parents it has, and
+after a transform changes (see XformNode.setXform() below), the next call
+only recomputes that node and its ancestors.
+  r.getCompositeArrays() returns the same information as three parallel
+sequences instead: an Nx4x4 array of transforms, a list of ShapeNodes, and a
+list of SurfaceNodes.
+  r.getVisibleArrays(planes) returns only the objects that might be inside a
+view volume (say, camera.frustumPlanes()), plus their indices in the full
+list.  Every node caches a bounding sphere of its subtree, so whole subtrees
+outside the view are skipped without visiting their objects.
   Note that you shouldn't ever directly modify the ShapeNode object, nor
 anything inside of it (like the vertices of the mesh).  Since you're dealing
 with a *reference* to the ShapeNode, any changes you make will affect that
@@ -66,6 +77,9 @@ The constructor for shape nodes takes two arguments:
 
 ShapeNode also makes the mesh a public attribute: for a shape node "s",
   s.mesh  # Get the mesh 2-tuple.
+  s.mesh = m  # Swap in another mesh.
+The cached bounding spheres are updated when the mesh is swapped, but not if
+the arrays inside it are changed in place.
 
 
 == GroupNode ==
@@ -84,6 +98,7 @@ order to create a transformation matrix.
   matrix.  The constructor takes two arguments:
    - M: a 4x4 matrix (numpy array) representing the transform.
    - name: a string, giving this transform a name.
+  The matrix can be replaced later with x.setXform(M).
   
   == TranslateNode ==
   The constructor for TranslateNode takes two arguments:
@@ -109,6 +124,20 @@ order to create a transformation matrix.
   The dimension arguments should each be 0, 1, or 2, which indicate
   X, Y, or Z respectively.
 
+  == Changing Transforms ==
+  Each of the four parameterized transform nodes keeps its parameters as
+  public attributes (t.vec, r.angles, s.factors, and sh.shear_dim,
+  sh.contrib_dim, sh.factor), and has a setter that changes them, updating
+  the node's matrix in place:
+    t.setVector(vec)
+    r.setAngles(angles)
+    s.setFactors(factors)
+    sh.setShear(shear_dim, contrib_dim, factor)
+  So to animate a scene, build its scenegraph once and then pose it for each
+  frame with these setters (say, r_elbow.setAngles(...)), rather than
+  building a new scenegraph every frame.  Only the composite transforms that
+  depend on a changed node get recomputed.
+
 
 == SurfaceNode ==
 A surface node determines the surface characteristics of every descendent
@@ -189,6 +218,7 @@ def test():
 # ------============= YOU DON'T NEED TO READ BELOW THIS LINE =============------
 # ------============= GORY IMPLEMENTATION DETAILS BELOW!     =============------
 
+import numpy as np
 import _scenegraph_base
 import transforms
 
@@ -204,8 +234,19 @@ class ShapeNode(_scenegraph_base.Node):
   """
   
   def __init__(self, mesh, name):
-    self.mesh = mesh
     super(ShapeNode, self).__init__(name)
+    self._mesh = mesh
+  
+  @property
+  def mesh(self):
+    return self._mesh
+  
+  @mesh.setter
+  def mesh(self, mesh):
+    # A new mesh changes this shape's bounding sphere, and so those of all
+    # its ancestors.
+    self._mesh = mesh
+    self._invalidate()
   
   def _addChild(self, c):
     msg = "Shape nodes can't have children."
@@ -213,41 +254,113 @@ class ShapeNode(_scenegraph_base.Node):
   
   def _traverse(self, T, surf):
     return [(T, self, surf)]
+  
+  def _compositeCache(self):
+    if self._cache is None:
+      xforms = np.eye(4)[None, :, :]
+      xforms.flags.writeable = False
+      self._cache = (xforms, [self], [None])
+    return self._cache
+  
+  def _boundingSphere(self):
+    if self._bound is None:
+      self._compositeCache()
+      sphere = None
+      if self.mesh is not None and self.mesh[0].shape[1] > 0:
+        verts = np.asarray(self.mesh[0], dtype=float)[:3].T
+        sphere = _scenegraph_base.enclosingSphere(verts,
+                                                  np.zeros(len(verts)))
+      self._bound = (sphere,)
+    return self._bound[0]
 
 
 class XformNode(_scenegraph_base.Node):
   def __init__(self, xform, name):
     super(XformNode, self).__init__(name)
     self._xform = xform
+  
+  def setXform(self, xform):
+    """Replaces this node's transformation matrix (a 4x4 numpy array).
+
+    The matrix is copied, so the node never shares it with the caller.
+    """
+    self._xform = np.array(xform, dtype=float)
+    self._invalidate()
+  
+  def _updateXform(self, xform):
+    # Overwrite the matrix in place when we can, so that the setters below
+    # don't allocate a new one for every frame of an animation.  That is
+    # only safe because the node's matrix is never one the caller holds:
+    # the constructors are handed fresh matrices, and setXform() copies.
+    if self._xform.dtype.kind == 'f':
+      self._xform[...] = xform
+    else:
+      self._xform = np.array(xform, dtype=float)
+    self._invalidate()
 
 class TranslateNode(XformNode):
   def __init__(self, vec, name=''):
+    self._label = name
+    self.vec = vec
     super(TranslateNode, self).__init__(
       transforms.translate(vec),
       name + " <translate by %s>" % vec.flatten()
     )
+  
+  def setVector(self, vec):
+    """Changes the translation vector (a 1-D, 3-element numpy array)."""
+    self.vec = vec
+    self.name = self._label + " <translate by %s>" % vec.flatten()
+    self._updateXform(transforms.translate(vec))
 
 class RotateNode(XformNode):
   def __init__(self, angles, name=''):
+    self._label = name
+    self.angles = angles
     super(RotateNode, self).__init__(
       transforms.rotate(angles),
       name + " <rotate by %s>" % str(tuple(angles.flatten()))
     )
+  
+  def setAngles(self, angles):
+    """Changes the yaw/pitch/roll angles (a 1-D, 3-element numpy array)."""
+    self.angles = angles
+    self.name = self._label + " <rotate by %s>" % str(tuple(angles.flatten()))
+    self._updateXform(transforms.rotate(angles))
 
 class ScaleNode(XformNode):
   def __init__(self, factors, name=''):
+    self._label = name
+    self.factors = factors
     super(ScaleNode, self).__init__(
       transforms.scale(factors),
       name + " <scale by %s>" % str(tuple(factors.flatten()))
     )
+  
+  def setFactors(self, factors):
+    """Changes the X/Y/Z scale factors (a 1-D, 3-element numpy array)."""
+    self.factors = factors
+    self.name = self._label + " <scale by %s>" % str(tuple(factors.flatten()))
+    self._updateXform(transforms.scale(factors))
 
 class ShearNode(XformNode):
   def __init__(self, shear_dim, contrib_dim, factor, name=''):
+    self._label = name
+    (self.shear_dim, self.contrib_dim, self.factor) = (
+      shear_dim, contrib_dim, factor)
     super(ShearNode, self).__init__(
       transforms.shear(shear_dim, contrib_dim, factor),
       name + " <shear in %s by %s*%s>" %
         ("XYZ"[shear_dim], factor, "XYZ"[contrib_dim])
     )
+  
+  def setShear(self, shear_dim, contrib_dim, factor):
+    """Changes the shear dimensions and factor (see the constructor)."""
+    (self.shear_dim, self.contrib_dim, self.factor) = (
+      shear_dim, contrib_dim, factor)
+    self.name = self._label + " <shear in %s by %s*%s>" % (
+      "XYZ"[shear_dim], factor, "XYZ"[contrib_dim])
+    self._updateXform(transforms.shear(shear_dim, contrib_dim, factor))
 
 
 class GroupNode(_scenegraph_base.Node):
@@ -289,11 +402,53 @@ class RootNode(_scenegraph_base.Node):
   def getCompositeTransforms(self):
     """Traverses the scenegraph and returns transforms for all objects.
     
-    Returns a list of 2-tuples.  In each tuple, the first element is a
+    Returns a list of 3-tuples.  In each tuple, the first element is a
     4x4 numpy array for the composite transform of a shape.  The second
-    element is a ShapeNode object.
+    element is a ShapeNode object, and the third is the SurfaceNode that
+    applies to it (or None).  The transform arrays are read-only.
+    
+    The composite transforms are cached throughout the scenegraph, so
+    calling this again after changing one transform only recomputes the
+    parts of the graph that depend on it.
+    """
+    (xforms, shapes, surfs) = self._compositeCache()
+    return list(zip(xforms, shapes, surfs))
+  
+  def getCompositeArrays(self):
+    """Traverses the scenegraph and returns transforms for all objects.
+    
+    This is getCompositeTransforms() in array form.  Returns a 3-tuple
+    (xforms, shapes, surfs): a read-only Nx4x4 numpy array of composite
+    transforms, and lists of the N ShapeNode objects and N SurfaceNode
+    objects (or Nones) they apply to.
+    """
+    (xforms, shapes, surfs) = self._compositeCache()
+    return (xforms, list(shapes), list(surfs))
+  
+  def getVisibleArrays(self, planes):
+    """Returns the composite transforms for the objects in a view volume.
+    
+    This is getCompositeArrays() with view-volume culling: any object whose
+    bounding sphere is entirely outside the volume is left out.  Each node
+    caches a bounding sphere for its subtree, and the traversal skips every
+    subtree entirely outside the volume (and stops testing below any
+    subtree entirely inside), so its cost grows with the visible part of
+    the scene rather than the whole of it.
+    
+    Argument planes is a Px4 numpy array of the world-space planes
+    bounding the volume, as returned by Camera.frustumPlanes().
+    
+    Returns a 4-tuple (xforms, shapes, surfs, indices): the first three as
+    for getCompositeArrays(), but for the visible objects only, and a 1-D
+    array of the visible objects' indices into the arrays that
+    getCompositeArrays() would return.
     """
-    return self._traverse()
+    (xforms, shapes, surfs) = self._compositeCache()
+    indices = self._visibleInstances(np.eye(4), planes, 0)
+    indices = np.concatenate(indices + [np.empty(0, dtype=int)])
+    indices = indices.astype(int)
+    return (xforms[indices], [shapes[i] for i in indices],
+            [surfs[i] for i in indices], indices)
   
   def _addParent(self, p):
     msg = "Root node can't be made a child of anything else."
@@ -0,0 +1,138 @@
+"""
+tile_renderer --- Tile-parallel rasterization across a process pool.
+
+The image and z-buffer are cut into square screen tiles, and each triangle
+is binned into every tile that its pixel bounding box overlaps.  Worker
+processes then rasterize whole tiles, each with the triangles in its bin,
+using projection_renderer.rasterizeTriangles().  Since the tiles don't
+overlap and every bin keeps the triangles in their original order, the
+result is identical to rasterizing the whole image at once.
+
+The image and z-buffer live in shared memory for the duration of the
+render, so the workers write their tiles in place and send nothing back
+but a "done" (or, when stats are being collected, their fragment counts).
+"""
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
+import numpy as np
+import projection_renderer
+import render_stats
+
+def rasterizeTiled(verts, tris, colors, img, z_buf, processes,
+                   tile_size=128, stats=render_stats.NO_STATS):
+  """Paints triangles onto an image with z-buffering, tile by tile.
+
+  Arguments:
+   - verts (4xN): the canonical-view coordinates of N vertices.
+   - tris (Tx3): the indices into verts of the corners of T triangles.
+   - colors (Tx3): the perceived color of each triangle.
+   - img (WxHx3): the image to draw into.  If img and colors are None,
+     only the z-buffer is drawn.
+   - z_buf (WxH): the z-buffer.
+   - processes: the number of worker processes.  If it's 1, the tiles
+     are rasterized in this process, with no pool at all.
+   - tile_size (optional; default 128): the tile edge length, in pixels.
+   - stats (optional): a RenderStats object to count fragments into.
+
+  Like rasterizeTriangles(), this has no return value; it modifies img
+  and z_buf, leaving them exactly as the serial rasterizers would.
+  """
+  (W,H) = z_buf.shape
+  tiles = [(a0, b0, min(tile_size, W - a0), min(tile_size, H - b0))
+           for a0 in range(0, W, tile_size)
+           for b0 in range(0, H, tile_size)]
+  bins = binTriangles(verts, tris, W, H, tiles)
+  jobs = [(tile, bin) for (tile, bin) in zip(tiles, bins) if len(bin) > 0]
+
+  if processes == 1:
+    for (tile, bin) in jobs:
+      _rasterizeTile(verts, tris, colors, img, z_buf, tile, bin, stats)
+    return
+
+  # Copy the buffers into shared memory, and give the workers numpy views of
+  # it.  The pool is created after everything it needs is in place, so on
+  # platforms that fork, the vertex and triangle arrays aren't pickled
+  # either.
+  shared_img = None if img is None else _sharedCopy(img)
+  shared_z = _sharedCopy(z_buf)
+  pool = multiprocessing.Pool(processes, _initWorker,
+    (shared_img, shared_z, verts, tris, colors, stats.enabled))
+  try:
+    for tile_stats in pool.imap_unordered(_workerRasterizeTile, jobs):
+      if tile_stats is not None:
+        stats.merge(tile_stats)
+    pool.close()
+  except:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  if img is not None:
+    img[...] = _sharedView(*shared_img)
+  z_buf[...] = _sharedView(*shared_z)
+
+def binTriangles(verts, tris, W, H, tiles):
+  """Sorts triangles into the screen tiles that they overlap.
+
+  Arguments:
+   - verts (4xN): the canonical-view coordinates of N vertices.
+   - tris (Tx3): the indices into verts of the corners of T triangles.
+   - W, H: the image dimensions, in pixels.
+   - tiles: a list of (a0, b0, w, h) tuples, one for each tile: the
+     corner pixel and the size of the tile.
+
+  Returns a list with one 1-D array for each tile: the (increasing)
+  indices of the triangles whose pixel bounding boxes overlap that tile.
+  """
+  (min_a, max_a, min_b, max_b) = projection_renderer._pixelBoundingBox(
+    verts[:2, tris].transpose((2,1,0)), W, H)
+  return [np.flatnonzero((max_a >= a0) & (min_a < a0 + w) &
+                         (max_b >= b0) & (min_b < b0 + h) &
+                         (max_a >= min_a) & (max_b >= min_b))
+          for (a0, b0, w, h) in tiles]
+
+def _rasterizeTile(verts, tris, colors, img, z_buf, tile, bin, stats):
+  """Rasterizes the triangles in one bin into their tile of img and z_buf.
+  """
+  (a0, b0, w, h) = tile
+  (W,H) = z_buf.shape
+  z_tile = z_buf[a0:a0+w, b0:b0+h]
+  (img_tile, tile_colors) = (None, None)
+  if img is not None:
+    (img_tile, tile_colors) = (img[a0:a0+w, b0:b0+h], colors[bin])
+  projection_renderer.rasterizeTriangles(
+    verts, tris[bin], tile_colors, img_tile, z_tile,
+    window=(a0, b0, W, H), stats=stats)
+
+def _sharedCopy(arr):
+  """Returns (buffer, dtype, shape) for a shared-memory copy of arr."""
+  buf = RawArray('b', arr.nbytes)
+  shared = (buf, arr.dtype, arr.shape)
+  _sharedView(*shared)[...] = arr
+  return shared
+
+def _sharedView(buf, dtype, shape):
+  """Returns a numpy array viewing a buffer made by _sharedCopy()."""
+  return np.frombuffer(buf, dtype=dtype).reshape(shape)
+
+# Per-process state for the pool workers, set up by _initWorker().
+_worker = {}
+
+def _initWorker(shared_img, shared_z, verts, tris, colors, with_stats):
+  _worker['img'] = None if shared_img is None else _sharedView(*shared_img)
+  _worker['z_buf'] = _sharedView(*shared_z)
+  _worker['verts'] = verts
+  _worker['tris'] = tris
+  _worker['colors'] = colors
+  _worker['with_stats'] = with_stats
+
+def _workerRasterizeTile(job):
+  (tile, bin) = job
+  if _worker['with_stats']:
+    stats = render_stats.RenderStats()
+  else:
+    stats = render_stats.NO_STATS
+  _rasterizeTile(_worker['verts'], _worker['tris'], _worker['colors'],
+                 _worker['img'], _worker['z_buf'], tile, bin, stats)
+  if stats.enabled:
+    return stats